@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark suite on synthetic data.
+
+Run as a script to benchmark the default scale points, save the report and
+optionally compare it with an earlier one:
+
+    python benchmark.py --output bench.json --baseline old_bench.json
+"""
+
+import argparse
+import gc
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+from class_candidates import Candidates
+from class_dwellings import Dwellings
+from obj_func_code import process_raster, process_population
+from synthetic_data import generate_dataset
+
+# Scale points benchmarked by default (generate_dataset arguments); the last
+# one has as many sites as the real data
+DEFAULT_SCALES = (
+    {'height': 300, 'width': 400, 'n_sites': 60, 'window': 40},
+    {'height': 800, 'width': 1000, 'n_sites': 300, 'window': 80},
+    {'height': 1500, 'width': 2000, 'n_sites': 1317, 'window': 100},
+)
+
+# Report entries where a larger value is better
+HIGHER_IS_BETTER = ('population_builds_per_s',)
+
+
+def _timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def _peak_memory(function):
+    # Peak traced allocation in MB; timings are taken in separate, untraced
+    # runs because tracing slows Python-level code down
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def scale_name(scale):
+    return f"{scale['height']}x{scale['width']}_{scale['n_sites']}sites_{scale['window']}px"
+
+
+def benchmark_scale(data_folder, build_size=10, n_evaluations=50, population=100, workers=None, seed=0):
+    """
+    Benchmarks loading, evaluation and neighbour queries on one data folder.
+
+    Args:
+        data_folder (Path): Folder written by generate_dataset().
+        build_size (int): Number of sites in each random build.
+        n_evaluations (int): Number of single-build evaluations timed.
+        population (int): Number of builds scored by process_population.
+        workers (int or None): Passed on to load_data and process_population.
+        seed (int): Seed of the random builds.
+
+    Returns:
+        dict: Seconds per loading stage, per-call latencies in milliseconds,
+              population throughput in builds per second and peak traced
+              memory in MB.
+    """
+    data_folder = Path(data_folder)
+    rng = np.random.default_rng(seed)
+    report = {}
+
+    # --- STEP 1: Loading ---
+    dwellings = Dwellings(data_folder)
+    _, report['load_dwellings_s'] = _timed(dwellings.load_data)
+    candidates, report['load_candidates_s'] = _timed(lambda: Candidates(data_folder))
+    _, report['load_rasters_s'] = _timed(lambda: candidates.load_data(workers=workers))
+    with tempfile.TemporaryDirectory() as store:
+        _, report['pack_s'] = _timed(lambda: candidates.pack_data(store))
+        packed = Candidates(data_folder)
+        _, report['load_packed_s'] = _timed(lambda: packed.load_packed(store))
+        del packed
+    report['peak_load_mb'] = _peak_memory(lambda: Candidates(data_folder).load_data())
+
+    # --- STEP 2: Neighbour queries ---
+    _, report['voronoi_s'] = _timed(candidates.get_voronoi)
+    ids = candidates.candidate_ids.tolist()
+    queries = rng.choice(ids, min(len(ids), 200), replace=False).tolist()
+    _, elapsed = _timed(lambda: [candidates.get_nearest_neighbours(site, 2) for site in queries])
+    report['neighbour_query_ms'] = 1000 * elapsed / len(queries)
+
+    # --- STEP 3: Evaluation latency and throughput ---
+    size = min(build_size, len(ids))
+    builds = [rng.choice(ids, size, replace=False).tolist() for _ in range(max(n_evaluations, population))]
+    latencies = []
+    for build in builds[:n_evaluations]:
+        latencies.append(_timed(lambda: process_raster(candidates, dwellings, build))[1])
+    report['evaluation_ms_median'] = 1000 * float(np.median(latencies))
+    report['evaluation_ms_p95'] = 1000 * float(np.percentile(latencies, 95))
+
+    _, elapsed = _timed(lambda: process_population(candidates, dwellings, builds[:population], workers=workers))
+    report['population_builds_per_s'] = population / elapsed
+    report['peak_population_mb'] = _peak_memory(
+        lambda: process_population(candidates, dwellings, builds[:population], workers=workers))
+
+    return report
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, work_folder=None, output=None, verbose=True, **kwargs):
+    """
+    Generates (or reuses) a synthetic data set per scale point and
+    benchmarks it.
+
+    Args:
+        scales (tuple): generate_dataset() arguments of each scale point.
+        work_folder (Path or None): Folder the data sets are kept in between
+                                    runs; a temporary folder when None.
+        output (Path or None): JSON file the report is written to.
+        verbose (bool): Print each scale point's results as it finishes.
+        **kwargs: Passed on to benchmark_scale().
+
+    Returns:
+        dict: {'machine': ..., 'results': [...]} with one result per scale.
+    """
+    report = {
+        'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                    'platform': platform.platform(), 'processor': platform.processor()},
+        'results': [],
+    }
+
+    with tempfile.TemporaryDirectory() as temporary:
+        root = Path(work_folder) if work_folder is not None else Path(temporary)
+        for scale in scales:
+            data_folder = root / scale_name(scale)
+            generate_s = 0.0
+            if not (data_folder / 'candidates.geojson').exists():
+                _, generate_s = _timed(lambda: generate_dataset(data_folder, **scale))
+
+            result = {'scale': scale_name(scale), **scale, 'generate_s': generate_s}
+            result.update(benchmark_scale(data_folder, **kwargs))
+            report['results'].append(result)
+            if verbose:
+                print(format_result(result))
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def format_result(result):
+    lines = [f"--- {result['scale']} ---"]
+    for key, value in result.items():
+        if isinstance(value, float):
+            lines.append(f'  {key:<26}{value:12.4f}')
+    return '\n'.join(lines)
+
+
+def compare_reports(baseline, current):
+    """
+    Compares two reports written by run_benchmarks().
+
+    Args:
+        baseline, current (dict or Path): Reports or their JSON files.
+
+    Returns:
+        list: (scale, metric, baseline value, current value, speed-up) for
+              every metric both reports share; speed-up > 1 means the current
+              run is better.
+    """
+    reports = []
+    for report in (baseline, current):
+        if not isinstance(report, dict):
+            with open(report) as f:
+                report = json.load(f)
+        reports.append({result['scale']: result for result in report['results']})
+
+    rows = []
+    for scale, new in reports[1].items():
+        old = reports[0].get(scale)
+        if old is None:
+            continue
+        for metric, value in new.items():
+            if not isinstance(value, float) or not isinstance(old.get(metric), float) or metric == 'generate_s':
+                continue
+            if metric in HIGHER_IS_BETTER:
+                speed_up = value / old[metric] if old[metric] else np.inf
+            else:
+                speed_up = old[metric] / value if value else np.inf
+            rows.append((scale, metric, old[metric], value, speed_up))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark loading and evaluation on synthetic data.')
+    parser.add_argument('--output', type=Path, help='JSON file for the report')
+    parser.add_argument('--baseline', type=Path, help='earlier report to compare against')
+    parser.add_argument('--work-folder', type=Path, help='keep the generated data sets here')
+    parser.add_argument('--workers', type=int, default=None, help='processes/threads for loading and evaluation')
+    parser.add_argument('--quick', action='store_true', help='only run the smallest scale point')
+    args = parser.parse_args()
+
+    report = run_benchmarks(DEFAULT_SCALES[:1] if args.quick else DEFAULT_SCALES, work_folder=args.work_folder,
+                            output=args.output, workers=args.workers)
+    if args.baseline is not None:
+        print('--- comparison with baseline (speed-up > 1 is better) ---')
+        for scale, metric, old, new, speed_up in compare_reports(args.baseline, report):
+            print(f'  {scale:<32}{metric:<26}{old:12.4f}{new:12.4f}{speed_up:8.2f}x')
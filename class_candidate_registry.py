@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Array-backed registry of the candidate sites.
+"""
+
+import json
+import os
+import zipfile
+from collections.abc import Mapping
+from pathlib import Path
+import numpy as np
+
+
+class CandidateRegistry(Mapping):
+    """
+    Candidate IDs, coordinates and raster windows held in contiguous arrays.
+
+    Row i of every array describes the candidate ids[i], in the order the
+    sites appear in the geojson file. The registry is also a read-only
+    mapping of candidate ID to [x, y], so it can stand in for the dict the
+    geojson used to be parsed into.
+    """
+
+    def __init__(self, ids, coords):
+        """
+        Attributes:
+            ids (np.ndarray): Candidate ID of every row.
+            coords (np.ndarray): (n, 2) float64 x, y coordinates.
+            row_of (dict): Candidate ID to row.
+            row_off, col_off, height, width (np.ndarray): int64 window of
+                every candidate in the main raster, -1 until the candidate's
+                rasters have been loaded.
+        """
+        self.ids = np.asarray(ids)
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.row_of = {candidate: row for row, candidate in enumerate(self.ids.tolist())}
+        self.row_off = np.full(len(self.ids), -1, dtype=np.int64)
+        self.col_off = np.full(len(self.ids), -1, dtype=np.int64)
+        self.height = np.full(len(self.ids), -1, dtype=np.int64)
+        self.width = np.full(len(self.ids), -1, dtype=np.int64)
+
+    @classmethod
+    def from_geojson(cls, path, sidecar=True):
+        """
+        Loads the registry of a candidates geojson file.
+
+        The parsed columns are saved to a binary sidecar next to the file
+        (candidates_registry.npz for candidates.geojson) and read from it on
+        later runs, until the geojson is modified.
+
+        Args:
+            path (Path): The candidates geojson file.
+            sidecar (bool): Whether to read and write the sidecar.
+        """
+        path = Path(path)
+        sidecar_path = path.with_name(f'{path.stem}_registry.npz')
+
+        if sidecar and sidecar_path.exists() and sidecar_path.stat().st_mtime >= path.stat().st_mtime:
+            try:
+                with np.load(sidecar_path) as cached:
+                    return cls(cached['ids'], cached['coords'])
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+                # An unreadable sidecar is rebuilt below
+                pass
+
+        ids, coords = parse_geojson_points(path)
+        if sidecar:
+            # Written under a temporary name and renamed into place, so other
+            # processes never read a half-written sidecar
+            temp_path = sidecar_path.with_name(f'{sidecar_path.name}.{os.getpid()}.tmp')
+            try:
+                with open(temp_path, 'wb') as f:
+                    np.savez(f, ids=ids, coords=coords)
+                os.replace(temp_path, sidecar_path)
+            except OSError:
+                # A read-only data folder only costs the cache
+                temp_path.unlink(missing_ok=True)
+        return cls(ids, coords)
+
+    def rows(self, candidates):
+        """
+        Returns the rows of a sequence of candidate IDs as an int64 array.
+        """
+        return np.array([self.row_of[candidate] for candidate in candidates], dtype=np.int64)
+
+    def set_window(self, candidate, window):
+        row = self.row_of[candidate]
+        self.row_off[row], self.col_off[row] = window.row_off, window.col_off
+        self.height[row], self.width[row] = window.height, window.width
+
+    def windows(self, candidates=None):
+        """
+        Returns (row_off, col_off, height, width) arrays for the given
+        candidate IDs, or for every row when candidates is None.
+        """
+        rows = slice(None) if candidates is None else self.rows(candidates)
+        return self.row_off[rows], self.col_off[rows], self.height[rows], self.width[rows]
+
+    def __getitem__(self, candidate):
+        return self.coords[self.row_of[candidate]].tolist()
+
+    def __iter__(self):
+        return iter(self.row_of)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, candidate):
+        return candidate in self.row_of
+
+
+def parse_geojson_points(path):
+    """
+    Reads the 'new_id' and point coordinates of every feature in a geojson
+    FeatureCollection into ID and coordinate columns.
+
+    Returns:
+        tuple: (ids, coords) where coords is an (n, 2) float64 array.
+
+    Raises:
+        ValueError: If the file has no 'features' array.
+    """
+    with open(path) as f:
+        collection = json.load(f)
+
+    if not isinstance(collection, dict) or 'features' not in collection:
+        raise ValueError(f'{path} is not a geojson FeatureCollection')
+
+    features = collection['features']
+    ids = np.array([feature['properties']['new_id'] for feature in features])
+    coords = np.array([feature['geometry']['coordinates'][:2] for feature in features], dtype=np.float64)
+    return ids, coords.reshape(-1, 2)
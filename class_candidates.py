@@ -5,14 +5,30 @@ Created on Fri Jun 28 04:12:27 2024
 
 @author: ksearle
 """
-import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from zipfile import ZipFile
 import numpy as np
-import networkx as nx
-from scipy.spatial import Voronoi
+from scipy.spatial import Voronoi, cKDTree
 import rasterio
 from rasterio.windows import Window
-import matplotlib.pyplot as plt
-import contextily as ctx  # For adding basemaps to geographic data plots
+from class_candidate_registry import CandidateRegistry
+import instrumentation
+
+# Layers written to, and read from, the packed candidate store
+PACKED_LAYERS = ('reduction', 'coverage', 'time')
+
+# Factor that decodes each layer when candidates are loaded with compact=True
+COMPACT_SCALES = {'reduction': 0.001, 'coverage': 1.0, 'time': 0.001}
+
+# Folder (or zip archive) holding each candidate layer
+LAYER_FOLDERS = {'reduction': 'v_i', 'coverage': 'v_b', 'time': 'v_t'}
 
 
 class Candidates:
@@ -30,8 +46,11 @@ class Candidates:
         Attributes:
             candidates_location_file (str): The file path to the geojson file 
                                             containing candidate locations.
-            candidate_locations (dict): A dictionary mapping candidate IDs to 
-                                        their coordinates (loaded from file).
+            registry (CandidateRegistry): Candidate IDs, coordinates and
+                                          windows as contiguous arrays.
+            all_candidates (CandidateRegistry): The same registry, read as a
+                                                mapping of candidate ID to
+                                                coordinates.
             candidates (dict or None): Stores selected candidates after filtering 
                                        by a specific resolution (initialized as None).
             neighbours (dict or None): Stores neighboring locations around each 
@@ -41,62 +60,121 @@ class Candidates:
         
         
         self.candidates_location_file = data_file / 'candidates.geojson'
-        self.all_candidates = self.load_candidate_locations()
+        self.registry = self.load_candidate_locations()
+        self.all_candidates = self.registry
         self.main_raster_path = data_file / "dwellings_count_utm_clipped.tif"
         self.data_file = data_file
         self.candidate_data = dict()
+        self.zip_index = dict()
+        self.compact = False
+        self.layer_scale = {layer: 1.0 for layer in COMPACT_SCALES}
+        self.kdtree = None
+        self._graph = None
+        self.pyramid = None
+        self.time_penalty = None
+        self.data_version = None
 
     def load_candidate_locations(self):
         """
         Loads candidate locations from a geojson file and organizes them by ID.
 
-        The function reads data from the specified geojson file, extracts each candidate's 
-        unique ID and coordinates, and stores them in a dictionary.
+        The geojson is parsed into ID and coordinate arrays, which are
+        cached in a binary sidecar file for later runs.
 
         Returns:
-            dict: A dictionary where keys are candidate IDs and values are coordinates 
-                  in the form of (longitude, latitude) tuples.
+            CandidateRegistry: Maps candidate IDs to coordinates in the form
+                               of [x, y] lists, backed by contiguous arrays.
         """
-        with open(self.candidates_location_file) as f:
-            data = json.load(f)
-        # Create a dictionary of candidate locations with ID as the key and coordinates as values
-        return {feature['properties']['new_id']: feature['geometry']['coordinates'] for feature in data['features']}
+        return CandidateRegistry.from_geojson(self.candidates_location_file)
     
     def get_voronoi(self):
         """
         Constructs a Voronoi diagram from candidate coordinates and 
         builds an adjacency graph where edges connect neighboring sites.
+
+        The adjacency is stored as CSR arrays over candidate rows together
+        with a KD-tree of the candidate coordinates, which
+        get_nearest_neighbours and get_all_neighbours use. The NetworkX graph
+        (self.G) is only built when first accessed, e.g. by plot_graph.
         """
     
-        # --- STEP 1: Extract candidate IDs and coordinates ---
-        # 'self.candidates' is assumed to be a dictionary:
-        #   key   = candidate ID
-        #   value = (x, y) coordinate
-        ids = list(self.all_candidates.keys())
-        coords = np.array(list(self.all_candidates.values()))
+        # --- STEP 1: Candidate IDs and coordinates from the registry ---
+        ids = self.registry.ids
+        coords = self.registry.coords
     
         # --- STEP 2: Compute Voronoi diagram ---
         # Each candidate location becomes a Voronoi seed point.
         vor = Voronoi(coords)
-    
-        # --- STEP 3: Initialize adjacency graph ---
-        # Use a NetworkX graph to represent neighbor relationships
-        # between candidate sites.
-        self.G = nx.Graph()
-        self.G.add_nodes_from(ids)  # Add all candidates as graph nodes
-    
-        # --- STEP 4: Add edges based on Voronoi adjacency ---
+
+        # --- STEP 3: Array-backed spatial index ---
         # ridge_points gives pairs of sites whose Voronoi cells share a border.
-        for p1, p2 in vor.ridge_points:
-            id1, id2 = ids[p1], ids[p2]  # Map Voronoi indices back to candidate IDs
-            self.G.add_edge(id1, id2)    # Connect candidates that are neighbors
-        
+        # The CSR adjacency over candidate rows keeps each row's neighbours in
+        # ridge order (the same order NetworkX reports them in).
+        ridges = np.unique(np.sort(vor.ridge_points, axis=1), axis=0, return_index=True)[1]
+        ridge_points = vor.ridge_points[np.sort(ridges)]
+        source = np.concatenate([ridge_points[:, 0], ridge_points[:, 1]])
+        target = np.concatenate([ridge_points[:, 1], ridge_points[:, 0]])
+        order = np.lexsort((np.tile(np.arange(len(ridge_points)), 2), source))
+
+        self.candidate_ids = ids
+        self.candidate_coords = coords
+        self.voronoi_ridges = ridge_points
+        self._graph = None
+        self.row_of = self.registry.row_of
+        self.adjacency_indptr = np.searchsorted(source[order], np.arange(len(ids) + 1))
+        self.adjacency_indices = target[order]
+        self.kdtree = cKDTree(coords)
+
+        # Distance from every site to its closest Voronoi neighbour
+        lengths = np.linalg.norm(coords[ridge_points[:, 0]] - coords[ridge_points[:, 1]], axis=1)
+        self.min_neighbour_dist = np.full(len(ids), np.inf)
+        np.minimum.at(self.min_neighbour_dist, ridge_points[:, 0], lengths)
+        np.minimum.at(self.min_neighbour_dist, ridge_points[:, 1], lengths)
+
+    @property
+    def G(self):
+        """
+        NetworkX graph of the Voronoi adjacency, built on first access.
+        """
+        if self._graph is None:
+            import networkx as nx
+
+            if self.kdtree is None:
+                self.get_voronoi()
+            ids = self.candidate_ids.tolist()
+            self._graph = nx.Graph()
+            self._graph.add_nodes_from(ids)  # Add all candidates as graph nodes
+            self._graph.add_edges_from((ids[p1], ids[p2]) for p1, p2 in self.voronoi_ridges.tolist())
+        return self._graph
+
+    def _neighbour_rows(self, row, radius, ball):
+        # Breadth-first search through Voronoi neighbours, only stepping onto
+        # sites within 'radius' of the starting site
+        origin = self.candidate_coords[row]
+        ball = np.asarray(ball, dtype=np.int64)
+        within = ball[np.sqrt(((self.candidate_coords[ball] - origin) ** 2).sum(axis=1)) <= radius]
+        allowed = set(within.tolist())
+
+        found = []
+        visited = {row}
+        queue = deque([row])
+        while queue:
+            current = queue.popleft()
+            for neighbour in self.adjacency_indices[self.adjacency_indptr[current]:self.adjacency_indptr[current + 1]].tolist():
+                if neighbour not in visited and neighbour in allowed:
+                    visited.add(neighbour)
+                    queue.append(neighbour)
+                    found.append(neighbour)
+        return found
 
-    
     def get_nearest_neighbours(self, location, dist):
         """
         Find nearest neighbors of a given location using the Voronoi adjacency graph.
         Neighboring sites are considered if they lie within a distance threshold.
+
+        The threshold is 'dist' times the distance to the closest Voronoi
+        neighbour; a site is returned if it lies within the threshold and can
+        be reached from 'location' through Voronoi neighbours that do too.
     
         Args:
             location (int/str): Candidate ID for which neighbors are being searched.
@@ -106,58 +184,67 @@ class Candidates:
         Returns:
             dict: Mapping of neighbor IDs to their coordinates.
         """
-    
-        # --- STEP 1: Setup containers ---
-        all_neighbours = {}   # Dictionary to store neighbor IDs and coordinates
-        visited = set()       # Track already-visited nodes to avoid cycles
-        queue = [location]    # BFS queue initialized with the starting location
-    
-        # --- STEP 2: Define distance threshold ---
-        # Compute the minimum Euclidean distance between the chosen location
-        # and each of its direct Voronoi neighbors.
-        # Multiply by 'dist' to scale the allowable neighborhood radius.
-        dist_threshold = dist * min(
-            np.linalg.norm(
-                np.array(self.all_candidates[location]) - np.array(self.all_candidates[neighbour])
-            )
-            for neighbour in self.G.neighbors(location)
-        )
-    
-        # --- STEP 3: Breadth-First Search (BFS) through Voronoi neighbors ---
-        while queue:
-            current = queue.pop(0)  # Dequeue next node
-            if current not in visited:
-                visited.add(current)  # Mark as visited
-    
-                # Explore all Voronoi neighbors of the current node
-                for neighbour in self.G.neighbors(current):
-                    if neighbour not in visited:
-                        # Compute Euclidean distance from original 'location' to this neighbor
-                        edge_dist = np.linalg.norm(
-                            np.array(self.all_candidates[location]) - np.array(self.all_candidates[neighbour])
-                        )
-    
-                        # If the neighbor lies within the distance threshold, add it
-                        if edge_dist <= dist_threshold:
-                            queue.append(neighbour)  # Enqueue for further exploration
-                            all_neighbours[neighbour] = self.all_candidates[neighbour]
+        if self.kdtree is None:
+            self.get_voronoi()
+
+        row = self.row_of[location]
+        radius = dist * self.min_neighbour_dist[row]
+        ball = self.kdtree.query_ball_point(self.candidate_coords[row], radius * (1 + 1e-9))
+
+        return {self.candidate_ids[neighbour].item(): self.candidate_coords[neighbour].tolist()
+                for neighbour in self._neighbour_rows(row, radius, ball)}
+
+    def get_all_neighbours(self, dist):
+        """
+        Finds the neighbourhood of every candidate in one call.
 
-        # --- STEP 4: Return dictionary of valid neighbors ---
-        return all_neighbours
+        Uses the same threshold and Voronoi-connectivity rule as
+        get_nearest_neighbours, with one vectorised KD-tree ball query for all
+        sites.
+
+        Args:
+            dist (float): Multiplier for the minimum neighbor distance.
+
+        Returns:
+            tuple: (indptr, neighbours) in CSR layout over self.candidate_ids;
+                   the neighbour IDs of candidate_ids[i] are
+                   neighbours[indptr[i]:indptr[i + 1]].
+        """
+        if self.kdtree is None:
+            self.get_voronoi()
+
+        radii = dist * self.min_neighbour_dist
+        balls = self.kdtree.query_ball_point(self.candidate_coords, radii * (1 + 1e-9))
+
+        indptr = np.zeros(len(self.candidate_ids) + 1, dtype=np.int64)
+        rows = []
+        for row, ball in enumerate(balls):
+            found = self._neighbour_rows(row, radii[row], ball)
+            rows.extend(found)
+            indptr[row + 1] = indptr[row] + len(found)
+
+        return indptr, self.candidate_ids[np.array(rows, dtype=np.int64)]
 
                             
    
     def plot_graph(self):
+        # Plotting libraries are imported here so the class stays usable in
+        # headless worker processes without them
+        import matplotlib.pyplot as plt
+        import networkx as nx
+        import contextily as ctx  # For adding basemaps to geographic data plots
+
         fig, ax = plt.subplots(figsize=(10, 10))
+        pos = dict(zip(self.registry.ids.tolist(), self.registry.coords))
 
         # Draw edges
-        nx.draw_networkx_edges(self.G, pos=self.all_candidates, edge_color='gray', width=0.5)
+        nx.draw_networkx_edges(self.G, pos=pos, edge_color='gray', width=0.5)
 
 
         # Draw nodes
         nx.draw_networkx_nodes(
             self.G,
-            pos=self.all_candidates,
+            pos=pos,
             node_color='skyblue',
             node_size=2.5
         )
@@ -173,35 +260,275 @@ class Candidates:
     
     
             
-    def load_data(self): 
-        
+    @instrumentation.timed('Candidates.load_data')
+    def load_data(self, workers=None, lazy=False, cache_size=256, compact=False):
+        """
+        Loads the reduction, coverage and time rasters of every candidate.
+
+        Args:
+            workers (int or None): Number of threads reading candidates in
+                                   parallel; None or 1 reads them one by one.
+                                   GDAL releases the GIL while reading, so
+                                   threads overlap the I/O and decoding.
+            lazy (bool): If True, nothing is read up front. candidate_data
+                         loads a candidate on first access and keeps at most
+                         cache_size of them in an LRU cache.
+            cache_size (int): Number of candidates kept resident when lazy.
+            compact (bool): If True, reduction and time are kept as the raw
+                            uint16 values (thousandths) and coverage as uint8.
+                            layer_scale records the factor the evaluators
+                            apply to decode them.
+        """
         with rasterio.open(self.main_raster_path) as src:
-            main_extent,  main_transform,  main_width,  main_height = src.bounds, src.transform, src.width, src.height
-        
-        for candidate in self.all_candidates:
-                with rasterio.open(self.data_file / 'v_i' / f'dry_walk_site_{candidate}.tif') as src:
-                    # Align small raster extent with main raster extent
-                    window = self.align_raster_to_main(src, main_transform, main_width, main_height)
-                    reduction = src.read(1, window=Window(0, 0, window.width, window.height))
-                    reduction = np.where(reduction < 0, 0, reduction)
-                    reduction = reduction/1000
-                    
-                
-                with rasterio.open(self.data_file / 'v_b' / f'dry_walk_site_{candidate}.tif') as src:
-                    # Align small raster extent with main raster extent
-                    
-                    coverage = src.read(1, window=Window(0, 0, window.width, window.height))
-                    coverage = np.where(coverage < 0, 0, coverage)
-                    
-                with rasterio.open(self.data_file / 'v_t' / f'dry_walk_site_{candidate}.tif') as src:
-                    # Align small raster extent with main raster extent
-                    
-                    time_taken = src.read(1, window=Window(0, 0, window.width, window.height))
-                    time_taken = np.where(time_taken < 0, 0, time_taken)
-                    time_taken = time_taken/1000
-                    
-                self.candidate_data[candidate] = {'window': window, 'reduction': reduction, 'coverage': coverage, 'time': time_taken }
-        
+            self.main_grid = (src.transform, src.width, src.height)
+
+        self.compact = compact
+        self.layer_scale = dict(COMPACT_SCALES) if compact else {layer: 1.0 for layer in COMPACT_SCALES}
+        # The travel-time penalty depends on the data and is recomputed on use,
+        # and the pyramid aggregates the old data so it must be rebuilt
+        self.time_penalty = None
+        self.pyramid = None
+        # New token per load, so caches keyed on it (e.g. plots) see the change
+        self.data_version = object()
+
+        if lazy:
+            self.candidate_data = LazyCandidateData(self.load_candidate, list(self.all_candidates), cache_size)
+        elif workers is None or workers <= 1:
+            self.candidate_data = {candidate: self.load_candidate(candidate) for candidate in self.all_candidates}
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                self.candidate_data = dict(zip(self.all_candidates, pool.map(self.load_candidate, self.all_candidates)))
+
+    def raster_path(self, folder, candidate):
+        """
+        Returns the path rasterio should open for one candidate raster.
+
+        If the extracted folder (e.g. data/v_i) exists the GeoTIFF inside it
+        is used. Otherwise the raster is read straight out of the matching zip
+        archive through GDAL's /vsizip/ handler, so the archives never need to
+        be extracted. Each archive's member list is read once and cached.
+
+        Args:
+            folder (str): One of 'v_i', 'v_b' or 'v_t'.
+            candidate (int): Candidate ID.
+        """
+        if folder not in self.zip_index:
+            zip_path = self.data_file / f'{folder}.zip'
+            if (self.data_file / folder).is_dir() or not zip_path.exists():
+                self.zip_index[folder] = None
+            else:
+                members = dict()
+                with ZipFile(zip_path) as z:
+                    for name in z.namelist():
+                        match = re.search(r'dry_walk_site_(\d+)\.tif$', name)
+                        if match:
+                            members[int(match.group(1))] = f'/vsizip/{zip_path.resolve().as_posix()}/{name}'
+                self.zip_index[folder] = members
+
+        if self.zip_index[folder] is None:
+            return self.data_file / folder / f'dry_walk_site_{candidate}.tif'
+        return self.zip_index[folder][candidate]
+
+    @instrumentation.timed('Candidates.load_candidate')
+    def load_candidate(self, candidate):
+        """
+        Reads and cleans the three rasters of one candidate.
+
+        Returns:
+            dict: {'window', 'reduction', 'coverage', 'time'} for the candidate.
+        """
+        main_transform, main_width, main_height = self.main_grid
+
+        with rasterio.open(self.raster_path('v_i', candidate)) as src:
+            # Align small raster extent with main raster extent
+            window = self.align_raster_to_main(src, main_transform, main_width, main_height)
+            reduction = src.read(1, window=Window(0, 0, window.width, window.height))
+            reduction = np.where(reduction < 0, 0, reduction)
+
+        with rasterio.open(self.raster_path('v_b', candidate)) as src:
+            coverage = src.read(1, window=Window(0, 0, window.width, window.height))
+            coverage = np.where(coverage < 0, 0, coverage)
+
+        with rasterio.open(self.raster_path('v_t', candidate)) as src:
+            time_taken = src.read(1, window=Window(0, 0, window.width, window.height))
+            time_taken = np.where(time_taken < 0, 0, time_taken)
+
+        if instrumentation.ENABLED:
+            instrumentation.count('files_opened', 3)
+            instrumentation.count('bytes_read', reduction.nbytes + coverage.nbytes + time_taken.nbytes)
+
+        if self.compact:
+            reduction = to_compact(reduction, np.uint16)
+            coverage = to_compact(coverage, np.uint8)
+            time_taken = to_compact(time_taken, np.uint16)
+        else:
+            reduction = reduction/1000
+            time_taken = time_taken/1000
+
+        self.registry.set_window(candidate, window)
+        return {'window': window, 'reduction': reduction, 'coverage': coverage, 'time': time_taken }
+
+    def pack_data(self, store_path=None):
+        """
+        Writes the loaded candidate rasters to a packed, memory-mappable store.
+
+        Every candidate's reduction, coverage and time patches are written
+        back-to-back into one binary file (one contiguous section per layer),
+        next to an index holding the candidate IDs, window offsets, patch
+        shapes and element offsets. Run load_data() once before packing; later
+        sessions can then use load_packed() instead.
+
+        The store is written under a temporary name and renamed into place
+        once complete, so an interrupted run never leaves a partial store. The
+        index records the size and modification time of every source file
+        (see source_state), which is_packed_current() checks.
+
+        Args:
+            store_path (Path or None): Directory for the store, defaults to
+                                       data_file / 'candidates_packed'.
+        """
+        final_path = Path(store_path) if store_path is not None else self.data_file / 'candidates_packed'
+        store_path = final_path.with_name(final_path.name + '.tmp')
+        if store_path.exists():
+            shutil.rmtree(store_path)
+        store_path.mkdir(parents=True)
+
+        ids = list(self.candidate_data.keys())
+        windows = [self.candidate_data[candidate]['window'] for candidate in ids]
+        shapes = np.array([self.candidate_data[candidate]['reduction'].shape for candidate in ids], dtype=np.int64).reshape(-1, 2)
+        patch_offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        patch_offsets[1:] = np.cumsum(shapes[:, 0] * shapes[:, 1])
+
+        dtypes, section_offsets = [], []
+        with open(store_path / 'candidates.bin', 'wb') as f:
+            for layer in PACKED_LAYERS:
+                patches = [np.asarray(self.candidate_data[candidate][layer]) for candidate in ids]
+                dtype = np.result_type(*patches) if patches else np.dtype(np.float32)
+                # Align every section so the memory map starts on a cache line
+                f.write(b'\0' * (-f.tell() % 64))
+                section_offsets.append(f.tell())
+                dtypes.append(dtype.str)
+                for patch in patches:
+                    f.write(np.ascontiguousarray(patch, dtype=dtype).tobytes())
+
+        np.savez(
+            store_path / 'candidates_index.npz',
+            ids=np.array(ids),
+            row_off=np.array([window.row_off for window in windows], dtype=np.int64),
+            col_off=np.array([window.col_off for window in windows], dtype=np.int64),
+            height=np.array([window.height for window in windows], dtype=np.int64),
+            width=np.array([window.width for window in windows], dtype=np.int64),
+            shapes=shapes,
+            patch_offsets=patch_offsets,
+            layers=np.array(PACKED_LAYERS),
+            dtypes=np.array(dtypes),
+            section_offsets=np.array(section_offsets, dtype=np.int64),
+            scales=np.array([self.layer_scale[layer] for layer in PACKED_LAYERS], dtype=np.float64),
+            compact=np.array(self.compact),
+            source_state=self.source_state(),
+        )
+
+        if final_path.exists():
+            shutil.rmtree(final_path)
+        os.replace(store_path, final_path)
+
+    def source_files(self):
+        """
+        Returns the files the candidate data is read from: the main raster,
+        the candidates geojson and each layer's GeoTIFFs (or its zip archive
+        when the folder has not been extracted).
+        """
+        files = [self.main_raster_path, self.candidates_location_file]
+        for folder in LAYER_FOLDERS.values():
+            if (self.data_file / folder).is_dir():
+                files.extend(sorted((self.data_file / folder).glob('*.tif')))
+            elif (self.data_file / f'{folder}.zip').exists():
+                files.append(self.data_file / f'{folder}.zip')
+        return files
+
+    def source_state(self):
+        """
+        Returns the names, sizes and modification times of source_files() as
+        one string, recorded by pack_data() to detect stale stores.
+        """
+        state = []
+        for path in self.source_files():
+            stat = path.stat()
+            state.append(f'{path.relative_to(self.data_file).as_posix()}:{stat.st_size}:{stat.st_mtime_ns}')
+        return np.array('\n'.join(state))
+
+    def is_packed_current(self, store_path=None):
+        """
+        Checks that a packed store exists, is complete and was written from
+        the current source files.
+
+        Args:
+            store_path (Path or None): Directory of the store, defaults to
+                                       data_file / 'candidates_packed'.
+
+        Returns:
+            bool: False if the store is missing, unreadable or stale.
+        """
+        store_path = Path(store_path) if store_path is not None else self.data_file / 'candidates_packed'
+        if not (store_path / 'candidates.bin').exists():
+            return False
+        try:
+            with np.load(store_path / 'candidates_index.npz') as index:
+                if 'source_state' not in index.files:
+                    return False
+                recorded = str(index['source_state'])
+        except (OSError, ValueError):
+            return False
+        return recorded == str(self.source_state())
+
+    @instrumentation.timed('Candidates.load_packed')
+    def load_packed(self, store_path=None):
+        """
+        Loads candidate data from a store written by pack_data().
+
+        The binary file is memory-mapped read-only, so every array in
+        candidate_data is a zero-copy view and processes that load the same
+        store share the same pages.
+
+        Args:
+            store_path (Path or None): Directory of the store, defaults to
+                                       data_file / 'candidates_packed'.
+        """
+        store_path = Path(store_path) if store_path is not None else self.data_file / 'candidates_packed'
+
+        with np.load(store_path / 'candidates_index.npz') as index:
+            index = {key: index[key] for key in index.files}
+
+        total = int(index['patch_offsets'][-1])
+        sections = {}
+        for layer, dtype, offset in zip(index['layers'], index['dtypes'], index['section_offsets']):
+            dtype = np.dtype(str(dtype))
+            if total == 0:
+                # np.memmap cannot map an empty region
+                sections[str(layer)] = np.zeros(0, dtype=dtype)
+            else:
+                sections[str(layer)] = np.memmap(store_path / 'candidates.bin', dtype=dtype, mode='r',
+                                                 offset=int(offset), shape=(total,))
+
+        self.layer_scale = {str(layer): float(scale) for layer, scale in zip(index['layers'], index['scales'])}
+        self.compact = bool(index['compact'])
+        self.time_penalty = None
+        self.pyramid = None
+        self.data_version = object()
+
+        rows = self.registry.rows(index['ids'].tolist())
+        for column in ('row_off', 'col_off', 'height', 'width'):
+            getattr(self.registry, column)[rows] = index[column]
+
+        self.candidate_data = dict()
+        for i, candidate in enumerate(index['ids'].tolist()):
+            start, stop = index['patch_offsets'][i], index['patch_offsets'][i + 1]
+            shape = tuple(index['shapes'][i])
+            entry = {'window': Window(int(index['col_off'][i]), int(index['row_off'][i]),
+                                      int(index['width'][i]), int(index['height'][i]))}
+            for layer, section in sections.items():
+                entry[layer] = section[start:stop].reshape(shape)
+            self.candidate_data[candidate] = entry
 
     def align_raster_to_main(self,small_raster, main_transform, main_width, main_height):
         small_bounds = small_raster.bounds
@@ -221,3 +548,78 @@ class Candidates:
         window = Window.from_slices((row_start, row_stop), (col_start, col_stop))
         return window
 
+
+def to_compact(values, dtype):
+    """
+    Casts cleaned raster values to a small unsigned integer dtype.
+
+    Raises:
+        ValueError: If the values are not whole numbers or do not fit the dtype.
+    """
+    values = np.nan_to_num(values, nan=0)
+    compact = values.astype(dtype)
+    if values.size and (values.max() > np.iinfo(dtype).max or not np.array_equal(compact, values)):
+        raise ValueError(f'Raster values cannot be stored losslessly as {np.dtype(dtype).name}')
+    return compact
+
+
+class LazyCandidateData(Mapping):
+    """
+    Read-only mapping of candidate ID to candidate data, loaded on demand.
+
+    Behaves like the candidate_data dict filled by Candidates.load_data(), but
+    each candidate is only read the first time it is accessed and at most
+    'maxsize' candidates are kept, evicting the least recently used one.
+    """
+
+    def __init__(self, loader, ids, maxsize=256):
+        self.loader = loader
+        self.ids = list(ids)
+        self.id_set = set(self.ids)
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, candidate):
+        with self.lock:
+            if candidate in self.cache:
+                self.cache.move_to_end(candidate)
+                self.hits += 1
+                instrumentation.count('candidate_cache_hits')
+                return self.cache[candidate]
+        if candidate not in self.id_set:
+            raise KeyError(candidate)
+
+        # Read outside the lock so other threads can load different candidates
+        data = self.loader(candidate)
+        instrumentation.count('candidate_cache_misses')
+        with self.lock:
+            self.misses += 1
+            self.cache[candidate] = data
+            self.cache.move_to_end(candidate)
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return data
+
+    def __getstate__(self):
+        # Pool workers (spawned processes) get an empty cache and a new lock
+        # rather than copies of the loaded patches
+        state = self.__dict__.copy()
+        del state['lock'], state['cache']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, candidate):
+        return candidate in self.id_set
@@ -5,27 +5,139 @@ Created on Wed May 14 14:26:14 2025
 @author: ksearle
 """
 
+import hashlib
+import os
+from pathlib import Path
 import rasterio
 import numpy as np
+import instrumentation
 
 
 class Dwellings:
     def __init__(self,data):
         self.main_raster_path = data / "dwellings_count_utm_clipped.tif"
         self.isolation_path = data / "dwellings_isolation_norm_utm.tif"
-        
-    def load_data(self):   
+        self.pixel_index = None
+        self.data_version = None
+
+    @instrumentation.timed('Dwellings.load_data')
+    def load_data(self, cache_dir=None):
+        """
+        Loads the dwelling count and isolation rasters.
+
+        Args:
+            cache_dir (Path or None): If given, the cleaned arrays are saved
+                                      there as .npy files on first use and
+                                      memory-mapped (read-only) afterwards, so
+                                      only the pages that are touched are
+                                      read and processes share them. The
+                                      files are rebuilt whenever a source
+                                      raster's size or mtime changes; old
+                                      versions stay until cache_dir is
+                                      cleared.
+        """
         with rasterio.open(self.main_raster_path) as main_src:
             self.main_extent,  self.main_transform,  self.main_width,  self.main_height = main_src.bounds, main_src.transform, main_src.width, main_src.height
 
-            
-            self.main_data = main_src.read(1)
-            self.main_data[self.main_data < 0] = 0
-            
+        if cache_dir is not None:
+            self.main_data, self.isolation_data = self.load_cached(Path(cache_dir))
+        else:
+            self.main_data, self.isolation_data = self.read_rasters()
+
+        self.total_dwellings = np.nansum(self.main_data, dtype=np.float64)
+        self.pixel_index = None
+        # New token per load, so caches keyed on it (e.g. plots) see the change
+        self.data_version = object()
+
+    @instrumentation.timed('Dwellings.read_rasters')
+    def read_rasters(self):
+        """
+        Reads and cleans the count and isolation values.
+
+        Returns:
+            tuple: (counts, isolation) arrays.
+        """
+        with rasterio.open(self.main_raster_path) as main_src:
+            main_data = main_src.read(1)
+            main_data[main_data < 0] = 0
+
         with rasterio.open(self.isolation_path) as src:
-            self.isolation_data = src.read(1)   # read raw raster values
-            self.isolation_data = np.nan_to_num(self.isolation_data, nan=0)   # replace NaN with 0
-            
+            isolation_data = src.read(1)   # read raw raster values
+            isolation_data = np.nan_to_num(isolation_data, nan=0)   # replace NaN with 0
+
+        if instrumentation.ENABLED:
+            instrumentation.count('files_opened', 2)
+            instrumentation.count('bytes_read', main_data.nbytes + isolation_data.nbytes)
+
+        return main_data, isolation_data
+
+    def source_state(self):
+        """
+        Returns the resolved path, size and modification time of both source
+        rasters as one string, identifying the data a cache was built from.
+        """
+        state = []
+        for path in (self.main_raster_path, self.isolation_path):
+            stat = path.stat()
+            state.append(f'{path.resolve().as_posix()}:{stat.st_size}:{stat.st_mtime_ns}')
+        return '\n'.join(state)
+
+    def load_cached(self, cache_dir):
+        # The cache files are named after a hash of the source state, so they
+        # are only reused for the exact rasters they were built from and
+        # several data sets can share one cache_dir
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.blake2b(self.source_state().encode(), digest_size=8).hexdigest()
+        paths = [cache_dir / f'dwellings_count_{digest}.npy', cache_dir / f'dwellings_isolation_{digest}.npy']
+        shape = (self.main_height, self.main_width)
+
+        if all(path.exists() for path in paths):
+            try:
+                arrays = tuple(np.load(path, mmap_mode='r') for path in paths)
+                if all(array.shape == shape for array in arrays):
+                    return arrays
+            except (OSError, ValueError):
+                pass
+
+        for path, array in zip(paths, self.read_rasters()):
+            # Written under a temporary name and renamed into place, so a
+            # concurrent reader never maps a half-written file
+            temp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+            with open(temp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(temp_path, path)
+
+        return tuple(np.load(path, mmap_mode='r') for path in paths)
+
+    def build_index(self, block_rows=1024):
+        """
+        Builds a compact index of the populated pixels.
+
+        A pixel is kept when it has dwellings or a non-zero isolation value.
+        The raster is scanned in blocks of rows so no full-size mask is
+        allocated.
+
+        Returns:
+            dict: 'flat' (flat index into the main raster), 'counts' and
+                  'isolation' (values at those pixels); also stored as
+                  self.pixel_index.
+        """
+        flat, counts, isolation = [], [], []
+        for row_start in range(0, self.main_height, block_rows):
+            main_block = self.main_data[row_start:row_start + block_rows]
+            isolation_block = self.isolation_data[row_start:row_start + block_rows]
+            local = np.flatnonzero((main_block > 0) | (isolation_block != 0))
+            flat.append(local + row_start * self.main_width)
+            counts.append(main_block.ravel()[local])
+            isolation.append(isolation_block.ravel()[local])
+
+        self.pixel_index = {
+            'flat': np.concatenate(flat) if flat else np.zeros(0, dtype=np.int64),
+            'counts': np.concatenate(counts) if counts else np.zeros(0, dtype=np.float32),
+            'isolation': np.concatenate(isolation) if isolation else np.zeros(0, dtype=np.float32),
+        }
+        return self.pixel_index
+
     def get_coordinates(self, r, c):
         x, y = rasterio.transform.xy(self.main_transform, r, c, offset='center')
         return [x,y]
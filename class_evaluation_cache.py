@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Memoisation cache in front of the objective function.
+"""
+
+import hashlib
+import sqlite3
+from collections import OrderedDict
+import numpy as np
+from obj_func_code import process_population
+import instrumentation
+
+
+def data_fingerprint(candidates, dwellings):
+    """
+    Hashes the rasters the objective function depends on.
+
+    Covers the dwelling and isolation arrays and every candidate's window,
+    reduction and coverage patch (and layer scale), so any change to the
+    input data produces a different fingerprint. This reads every candidate,
+    so with lazy loading it loads them all once; pass a fingerprint to
+    EvaluationCache to skip it.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for array in (dwellings.main_data, dwellings.isolation_data):
+        array = np.ascontiguousarray(array)
+        digest.update(f'{array.dtype.str}{array.shape}'.encode())
+        digest.update(array.data)
+    digest.update(repr(sorted(candidates.layer_scale.items())).encode())
+    for candidate, data in candidates.candidate_data.items():
+        window = data['window']
+        digest.update(f'{candidate}:{window.row_off},{window.col_off},{window.height},{window.width}'.encode())
+        for layer in ('reduction', 'coverage'):
+            patch = np.ascontiguousarray(data[layer])
+            digest.update(patch.dtype.str.encode())
+            digest.update(patch.data)
+    return digest.hexdigest()
+
+
+class EvaluationCache:
+    """
+    Order-insensitive cache of objective totals keyed by the set of sites.
+
+    Results are kept in a bounded in-memory LRU tier and, if db_path is
+    given, in an SQLite file. Disk entries are stored under a fingerprint of
+    the input rasters and the pyramid factor they were scored at (1 for
+    native resolution), so they survive across sessions and are ignored as
+    soon as the data or the pyramid changes. Reloading candidates or
+    dwellings (a new data_version) empties the memory tier and recomputes
+    the fingerprint.
+    """
+
+    def __init__(self, candidates, dwellings, maxsize=100000, db_path=None, engine=None, workers=None,
+                 fingerprint=None):
+        """
+        Attributes:
+            candidates (Candidates): Candidates with load_data() already run.
+            dwellings (Dwellings): Dwellings with load_data() already run.
+            maxsize (int): Maximum number of builds kept in memory.
+            db_path (Path or None): SQLite file for the on-disk tier.
+            engine (SparseObjective or None): Passed on to process_population.
+            workers (int or None): Passed on to process_population.
+            fingerprint (str or None): Overrides data_fingerprint() for the
+                                       data loaded now; it is recomputed
+                                       if either object is reloaded.
+            hits, disk_hits, misses (int): Lookup statistics.
+        """
+        self.candidates = candidates
+        self.dwellings = dwellings
+        self.maxsize = maxsize
+        self.engine = engine
+        self.workers = workers
+        self.fingerprint = fingerprint if fingerprint is not None else data_fingerprint(candidates, dwellings)
+        self.data_versions = (candidates.data_version, dwellings.data_version)
+
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = None
+        if db_path is not None:
+            self.db = sqlite3.connect(str(db_path))
+            self.db.execute('CREATE TABLE IF NOT EXISTS scores ('
+                            'fingerprint TEXT, factor INTEGER, build TEXT, '
+                            'reduction REAL, coverage REAL, fairness REAL, '
+                            'PRIMARY KEY (fingerprint, factor, build))')
+            self.db.commit()
+
+    # ------------------------------------------------------------------ tiers
+
+    @staticmethod
+    def build_key(build):
+        return ','.join(str(site) for site in sorted(set(build)))
+
+    def _remember(self, key, result):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def _lookup(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            instrumentation.count('cache_hits')
+            return self.memory[key]
+        if self.db is not None:
+            row = self.db.execute('SELECT reduction, coverage, fairness FROM scores '
+                                  'WHERE fingerprint = ? AND factor = ? AND build = ?',
+                                  (self.fingerprint, key[1], self.build_key(key[0]))).fetchone()
+            if row is not None:
+                self.disk_hits += 1
+                instrumentation.count('cache_disk_hits')
+                self._remember(key, row)
+                return row
+        return None
+
+    def _store(self, items):
+        for key, result in items:
+            self._remember(key, result)
+        if self.db is not None and items:
+            self.db.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?)',
+                                [(self.fingerprint, key[1], self.build_key(key[0]), *result) for key, result in items])
+            self.db.commit()
+
+    def _check_data(self):
+        # A reload invalidates every result computed from the previous data
+        versions = (self.candidates.data_version, self.dwellings.data_version)
+        if versions != self.data_versions:
+            self.fingerprint = data_fingerprint(self.candidates, self.dwellings)
+            self.data_versions = versions
+            self.memory.clear()
+
+    def factor(self, level):
+        """
+        Returns the cell-size factor of a pyramid level (1 for level 0),
+        which identifies the level's data, unlike its index.
+        """
+        if not level:
+            return 1
+        if self.candidates.pyramid is None:
+            raise ValueError('No RasterPyramid is attached to the candidates')
+        return int(self.candidates.pyramid.level(level).factor)
+
+    # ------------------------------------------------------------------ evaluation
+
+    def process_raster(self, selected_raster_numbers, level=0):
+        """
+        Returns the (reduction, coverage, fairness) totals of a build,
+        computing them only if the set of sites has not been seen before.
+        """
+        return tuple(self.process_population([selected_raster_numbers], level=level)[0])
+
+    def process_population(self, list_of_builds, level=0):
+        """
+        Scores a list of builds, evaluating only the cache misses (in one
+        process_population call). Repeats of a build within the list count
+        as memory hits.
+
+        Returns:
+            np.ndarray: (n_individuals, 3) array of totals.
+        """
+        self._check_data()
+        factor = self.factor(level)
+        keys = [(frozenset(build), factor) for build in list_of_builds]
+        results = {}
+        missing = {}
+        for key, build in zip(keys, list_of_builds):
+            if key in results or key in missing:
+                # A repeat within the batch is served from memory
+                self.hits += 1
+                instrumentation.count('cache_hits')
+                continue
+            found = self._lookup(key)
+            if found is None:
+                missing[key] = list(build)
+            else:
+                results[key] = found
+
+        if missing:
+            scores = process_population(self.candidates, self.dwellings, list(missing.values()),
+                                        workers=self.workers, engine=self.engine, level=level)
+            self.misses += len(missing)
+            instrumentation.count('cache_misses', len(missing))
+            computed = [(key, tuple(float(value) for value in score)) for key, score in zip(missing, scores)]
+            self._store(computed)
+            results.update(computed)
+
+        return np.array([results[key] for key in keys], dtype=np.float64).reshape(len(keys), 3)
+
+    # ------------------------------------------------------------------ housekeeping
+
+    def stats(self):
+        """
+        Returns hit/miss counts and the hit rate.
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            'memory_entries': len(self.memory),
+        }
+
+    def purge_stale(self):
+        """
+        Deletes on-disk results computed from other versions of the data.
+        """
+        if self.db is not None:
+            self._check_data()
+            self.db.execute('DELETE FROM scores WHERE fingerprint != ?', (self.fingerprint,))
+            # Results of earlier versions were keyed on the level index
+            self.db.execute('DROP TABLE IF EXISTS results')
+            self.db.commit()
+
+    def clear(self):
+        """
+        Empties the in-memory tier and resets the statistics.
+        """
+        self.memory.clear()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Stateful objective evaluator for single-site moves.
+"""
+
+import numpy as np
+
+
+class IncrementalEvaluator:
+    """
+    Keeps the composite of a build so single-site moves can be scored cheaply.
+
+    For both the reduction and the coverage layer the evaluator stores, per
+    pixel of the main raster, the best and second-best value over the
+    selected sites and which site owns the best value. Adding, removing or
+    swapping a site then only touches that site's window, and the peek_*
+    methods score a move without applying it.
+    """
+
+    def __init__(self, candidates, dwellings, build=()):
+        """
+        Initializes the evaluator with an optional starting build.
+
+        Attributes:
+            candidates (Candidates): Candidates with load_data() already run.
+            dwellings (Dwellings): Dwellings with load_data() already run.
+            build (list): Candidate IDs currently selected.
+            totals (tuple): Current (reduction, coverage, fairness) totals.
+        """
+        self.candidates = candidates
+        self.dwellings = dwellings
+
+        shape = (dwellings.main_height, dwellings.main_width)
+        self.best = {layer: np.zeros(shape, dtype=np.float32) for layer in ('reduction', 'coverage')}
+        self.second = {layer: np.zeros(shape, dtype=np.float32) for layer in ('reduction', 'coverage')}
+        self.owner = {layer: np.full(shape, -1, dtype=np.int32) for layer in ('reduction', 'coverage')}
+
+        self.selected = {}       # candidate ID -> owner code used in self.owner
+        self._next_code = 0
+        self._totals = np.zeros(3, dtype=np.float64)
+
+        for site in build:
+            self.add(site)
+
+    @property
+    def build(self):
+        return list(self.selected.keys())
+
+    @property
+    def totals(self):
+        return tuple(self._totals)
+
+    # ------------------------------------------------------------------ helpers
+
+    def _window(self, site):
+        window = self.candidates.candidate_data[site]['window']
+        return (slice(window.row_off, window.row_off + window.height),
+                slice(window.col_off, window.col_off + window.width))
+
+    def _patch(self, site, layer):
+        # Decodes compact layers on the fly; float layers have a scale of 1
+        patch = np.asarray(self.candidates.candidate_data[site][layer], dtype=np.float32)
+        return np.nan_to_num(patch * np.float32(self.candidates.layer_scale[layer]))
+
+    def _weights(self, rows, cols):
+        return self.dwellings.main_data[rows, cols], self.dwellings.isolation_data[rows, cols]
+
+    def _score(self, reduction, coverage, main_data, isolation_data):
+        return np.array([np.sum(reduction * main_data),
+                         np.sum(coverage * main_data),
+                         np.sum(coverage * isolation_data)], dtype=np.float64)
+
+    @staticmethod
+    def _overlap(a, b):
+        rows = slice(max(a[0].start, b[0].start), min(a[0].stop, b[0].stop))
+        cols = slice(max(a[1].start, b[1].start), min(a[1].stop, b[1].stop))
+        if rows.start >= rows.stop or cols.start >= cols.stop:
+            return None
+        return rows, cols
+
+    def _insert(self, layer, code, patch, rows, cols):
+        best, second, owner = self.best[layer][rows, cols], self.second[layer][rows, cols], self.owner[layer][rows, cols]
+        better = patch > best
+        second[...] = np.where(better, best, np.maximum(second, patch))
+        best[...] = np.where(better, patch, best)
+        owner[better] = code
+
+    def _delta_add(self, site, removed_code=None):
+        # Gain of adding 'site' on top of the current composite, optionally
+        # with the site owning 'removed_code' taken out first
+        rows, cols = self._window(site)
+        main_data, isolation_data = self._weights(rows, cols)
+        composite = {}
+        for layer in ('reduction', 'coverage'):
+            base = self.best[layer][rows, cols]
+            if removed_code is not None:
+                base = np.where(self.owner[layer][rows, cols] == removed_code, self.second[layer][rows, cols], base)
+            composite[layer] = (base, np.maximum(base, self._patch(site, layer)))
+        return (self._score(composite['reduction'][1], composite['coverage'][1], main_data, isolation_data)
+                - self._score(composite['reduction'][0], composite['coverage'][0], main_data, isolation_data))
+
+    def _delta_remove(self, site):
+        code = self.selected[site]
+        rows, cols = self._window(site)
+        main_data, isolation_data = self._weights(rows, cols)
+        loss = {}
+        for layer in ('reduction', 'coverage'):
+            owned = self.owner[layer][rows, cols] == code
+            loss[layer] = np.where(owned, self.second[layer][rows, cols] - self.best[layer][rows, cols], 0)
+        return self._score(loss['reduction'], loss['coverage'], main_data, isolation_data)
+
+    def _check_move(self, out=None, into=None):
+        if out is not None and out not in self.selected:
+            raise ValueError(f'Candidate {out} is not in the current build')
+        if into is not None and into in self.selected:
+            raise ValueError(f'Candidate {into} is already in the current build')
+
+    # ------------------------------------------------------------------ moves
+
+    def add(self, site):
+        """
+        Adds a site to the build and returns the new totals.
+        """
+        self._check_move(into=site)
+        self._totals += self._delta_add(site)
+
+        code = self._next_code
+        self._next_code += 1
+        self.selected[site] = code
+        rows, cols = self._window(site)
+        for layer in ('reduction', 'coverage'):
+            self._insert(layer, code, self._patch(site, layer), rows, cols)
+        return self.totals
+
+    def remove(self, site):
+        """
+        Removes a site from the build and returns the new totals.
+
+        The best/second-best state of the site's window is rebuilt from the
+        remaining selected sites that overlap it.
+        """
+        self._check_move(out=site)
+        self._totals += self._delta_remove(site)
+        del self.selected[site]
+
+        window = self._window(site)
+        for layer in ('reduction', 'coverage'):
+            self.best[layer][window] = 0
+            self.second[layer][window] = 0
+            self.owner[layer][window] = -1
+
+        for other, code in self.selected.items():
+            other_window = self._window(other)
+            overlap = self._overlap(window, other_window)
+            if overlap is None:
+                continue
+            rows, cols = overlap
+            local = (slice(rows.start - other_window[0].start, rows.stop - other_window[0].start),
+                     slice(cols.start - other_window[1].start, cols.stop - other_window[1].start))
+            for layer in ('reduction', 'coverage'):
+                self._insert(layer, code, self._patch(other, layer)[local], rows, cols)
+        return self.totals
+
+    def swap(self, out, into):
+        """
+        Replaces site 'out' with site 'into' and returns the new totals.
+        """
+        self._check_move(out=out, into=into)
+        self.remove(out)
+        return self.add(into)
+
+    # ------------------------------------------------------------------ peeks
+
+    def peek_add(self, site):
+        """
+        Returns the totals the build would have after add(site).
+        """
+        self._check_move(into=site)
+        return tuple(self._totals + self._delta_add(site))
+
+    def peek_remove(self, site):
+        """
+        Returns the totals the build would have after remove(site).
+        """
+        self._check_move(out=site)
+        return tuple(self._totals + self._delta_remove(site))
+
+    def peek_swap(self, out, into):
+        """
+        Returns the totals the build would have after swap(out, into).
+        """
+        self._check_move(out=out, into=into)
+        return tuple(self._totals + self._delta_remove(out) + self._delta_add(into, removed_code=self.selected[out]))
+
+    def peek_swaps(self, out, sites):
+        """
+        Scores swapping 'out' for each of 'sites' without changing the build.
+
+        Sites already in the build are skipped, so the keys of
+        Candidates.get_nearest_neighbours(out, dist) can be passed directly.
+
+        Returns:
+            dict: Mapping of each candidate ID to its post-swap totals.
+        """
+        self._check_move(out=out)
+        removal = self._totals + self._delta_remove(out)
+        code = self.selected[out]
+        return {site: tuple(removal + self._delta_add(site, removed_code=code))
+                for site in sites if site not in self.selected}
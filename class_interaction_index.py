@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Pairwise interaction index over the candidate windows.
+"""
+
+import numpy as np
+
+
+class InteractionIndex:
+    """
+    Records which pairs of candidates can interact in the objective function.
+
+    Two candidates interact when their windows overlap on a populated pixel
+    (dwellings or non-zero isolation) where both have a non-zero reduction or
+    coverage value. Sites that do not interact contribute independently to
+    the totals, so a build can be split into clusters that are scored (and
+    cached) separately.
+    """
+
+    def __init__(self, ids, pair_i, pair_j, overlap_area, shared_coverage, coverage):
+        """
+        Attributes:
+            ids (np.ndarray): Candidate IDs; pairs refer to positions in ids.
+            pair_i, pair_j (np.ndarray): Rows of each interacting pair (i < j).
+            overlap_area (np.ndarray): Number of pixels shared by the windows.
+            shared_coverage (np.ndarray): Dwelling-weighted sum of the smaller
+                                          of the two coverage values over the
+                                          overlap.
+            coverage (np.ndarray): Dwelling-weighted coverage of each
+                                   candidate on its own.
+        """
+        self.ids = np.asarray(ids)
+        self.pair_i = np.asarray(pair_i, dtype=np.int64)
+        self.pair_j = np.asarray(pair_j, dtype=np.int64)
+        self.overlap_area = np.asarray(overlap_area, dtype=np.int64)
+        self.shared_coverage = np.asarray(shared_coverage, dtype=np.float64)
+        self.coverage = np.asarray(coverage, dtype=np.float64)
+        self.row_of = {candidate: row for row, candidate in enumerate(self.ids.tolist())}
+        self.pair_of = {(i, j): k for k, (i, j) in enumerate(zip(self.pair_i.tolist(), self.pair_j.tolist()))}
+
+        # Symmetric CSR neighbour table over rows
+        source = np.concatenate([self.pair_i, self.pair_j])
+        target = np.concatenate([self.pair_j, self.pair_i])
+        order = np.argsort(source, kind='stable')
+        self.indptr = np.searchsorted(source[order], np.arange(self.ids.size + 1))
+        self.indices = target[order]
+
+    @classmethod
+    def build(cls, candidates, dwellings):
+        """
+        Builds the index from loaded Candidates and Dwellings objects.
+        """
+        ids = list(candidates.candidate_data.keys())
+        windows = [candidates.candidate_data[candidate]['window'] for candidate in ids]
+        row_start = np.array([window.row_off for window in windows], dtype=np.int64)
+        col_start = np.array([window.col_off for window in windows], dtype=np.int64)
+        row_stop = row_start + np.array([window.height for window in windows], dtype=np.int64)
+        col_stop = col_start + np.array([window.width for window in windows], dtype=np.int64)
+
+        populated = (dwellings.main_data > 0) | (dwellings.isolation_data != 0)
+        scale = candidates.layer_scale['coverage']
+
+        def layers(row):
+            data = candidates.candidate_data[ids[row]]
+            coverage = np.nan_to_num(np.asarray(data['coverage'], dtype=np.float64)) * scale
+            active = (np.nan_to_num(np.asarray(data['reduction'])) > 0) | (coverage > 0)
+            return coverage, active
+
+        # --- STEP 1: Stand-alone coverage of every candidate ---
+        coverage = np.zeros(len(ids))
+        for row in range(len(ids)):
+            rows, cols = slice(row_start[row], row_stop[row]), slice(col_start[row], col_stop[row])
+            coverage[row] = np.sum(layers(row)[0] * dwellings.main_data[rows, cols])
+
+        # --- STEP 2: Check every pair whose windows overlap ---
+        pair_i, pair_j, overlap_area, shared_coverage = [], [], [], []
+        for i in range(len(ids)):
+            others = np.arange(i + 1, len(ids))
+            overlapping = others[(row_start[others] < row_stop[i]) & (row_start[i] < row_stop[others])
+                                 & (col_start[others] < col_stop[i]) & (col_start[i] < col_stop[others])]
+            if overlapping.size == 0:
+                continue
+            coverage_i, active_i = layers(i)
+
+            for j in overlapping.tolist():
+                r0, r1 = max(row_start[i], row_start[j]), min(row_stop[i], row_stop[j])
+                c0, c1 = max(col_start[i], col_start[j]), min(col_stop[i], col_stop[j])
+                local_i = (slice(r0 - row_start[i], r1 - row_start[i]), slice(c0 - col_start[i], c1 - col_start[i]))
+                local_j = (slice(r0 - row_start[j], r1 - row_start[j]), slice(c0 - col_start[j], c1 - col_start[j]))
+
+                coverage_j, active_j = layers(j)
+                if not np.any(active_i[local_i] & active_j[local_j] & populated[r0:r1, c0:c1]):
+                    continue
+
+                pair_i.append(i)
+                pair_j.append(j)
+                overlap_area.append((r1 - r0) * (c1 - c0))
+                shared_coverage.append(np.sum(np.minimum(coverage_i[local_i], coverage_j[local_j])
+                                              * dwellings.main_data[r0:r1, c0:c1]))
+
+        return cls(np.array(ids), pair_i, pair_j, overlap_area, shared_coverage, coverage)
+
+    def save(self, path):
+        """
+        Saves the index to a single .npz file.
+        """
+        np.savez(path, ids=self.ids, pair_i=self.pair_i, pair_j=self.pair_j, overlap_area=self.overlap_area,
+                 shared_coverage=self.shared_coverage, coverage=self.coverage)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index previously written by save().
+        """
+        with np.load(path) as data:
+            return cls(**{key: data[key] for key in data.files})
+
+    def neighbours(self, site):
+        """
+        Returns the IDs of all candidates that interact with 'site'.
+        """
+        row = self.row_of[site]
+        return self.ids[self.indices[self.indptr[row]:self.indptr[row + 1]]].tolist()
+
+    def interacts(self, a, b):
+        """
+        Returns True if candidates 'a' and 'b' interact.
+        """
+        i, j = sorted((self.row_of[a], self.row_of[b]))
+        return (i, j) in self.pair_of
+
+    def redundancy(self, a, b):
+        """
+        Fraction of the smaller stand-alone coverage that the two sites share.
+
+        A value close to 1 means one site adds almost no coverage when the
+        other is already built.
+        """
+        i, j = sorted((self.row_of[a], self.row_of[b]))
+        pair = self.pair_of.get((i, j))
+        smallest = min(self.coverage[i], self.coverage[j])
+        if pair is None or smallest <= 0:
+            return 0.0
+        return float(self.shared_coverage[pair] / smallest)
+
+    def clusters(self, build):
+        """
+        Splits a build into groups of sites that interact with each other.
+
+        Sites in different groups never share a populated pixel, so the
+        objective totals of the build are the sum of the totals of the groups.
+
+        Returns:
+            list: One list of candidate IDs per cluster.
+        """
+        rows = [self.row_of[site] for site in dict.fromkeys(build)]
+        parent = {row: row for row in rows}
+
+        def find(row):
+            while parent[row] != row:
+                parent[row] = parent[parent[row]]
+                row = parent[row]
+            return row
+
+        for row in rows:
+            for other in self.indices[self.indptr[row]:self.indptr[row + 1]].tolist():
+                if other in parent:
+                    parent[find(other)] = find(row)
+
+        groups = {}
+        for row in rows:
+            groups.setdefault(find(row), []).append(self.ids[row].item())
+        return list(groups.values())
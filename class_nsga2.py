@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+NSGA-II optimiser over candidate sites.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+import numpy as np
+from obj_func_code import population_pool, process_population
+
+
+def fast_non_dominated_sort(objectives):
+    """
+    Ranks solutions into Pareto fronts (all objectives are maximised).
+
+    Args:
+        objectives (np.ndarray): (n, m) array of objective values.
+
+    Returns:
+        np.ndarray: Front index of every solution, 0 being the Pareto front.
+    """
+    objectives = np.asarray(objectives, dtype=np.float64)
+    # dominates[i, j] is True when solution i dominates solution j
+    better_or_equal = np.all(objectives[:, None, :] >= objectives[None, :, :], axis=2)
+    strictly_better = np.any(objectives[:, None, :] > objectives[None, :, :], axis=2)
+    dominates = better_or_equal & strictly_better
+
+    dominated_by = dominates.sum(axis=0)
+    ranks = np.full(len(objectives), -1, dtype=np.int64)
+    front = np.flatnonzero(dominated_by == 0)
+    rank = 0
+    while front.size:
+        ranks[front] = rank
+        dominated_by -= dominates[front].sum(axis=0)
+        dominated_by[front] = -1
+        front = np.flatnonzero(dominated_by == 0)
+        rank += 1
+    return ranks
+
+
+def crowding_distance(objectives, ranks):
+    """
+    Computes the crowding distance of every solution within its front.
+
+    Boundary solutions of each front get an infinite distance.
+    """
+    objectives = np.asarray(objectives, dtype=np.float64)
+    distance = np.zeros(len(objectives))
+    for rank in np.unique(ranks):
+        members = np.flatnonzero(ranks == rank)
+        if members.size <= 2:
+            distance[members] = np.inf
+            continue
+        values = objectives[members]
+        order = np.argsort(values, axis=0, kind='stable')
+        ordered = np.take_along_axis(values, order, axis=0)
+        spread = ordered[-1] - ordered[0]
+        spread[spread == 0] = 1.0
+        gaps = np.zeros_like(values)
+        gaps[1:-1] = (ordered[2:] - ordered[:-2]) / spread
+        gaps[0] = gaps[-1] = np.inf
+        # Scatter the per-objective gaps back to the members' positions
+        contribution = np.zeros_like(values)
+        np.put_along_axis(contribution, order, gaps, axis=0)
+        distance[members] = contribution.sum(axis=1)
+    return distance
+
+
+class NSGA2:
+    """
+    Multi-objective genetic algorithm selecting a fixed number of sites.
+
+    Each individual is a set of n_sites candidate IDs. Reduction, coverage
+    and fairness (the totals returned by process_raster) are maximised.
+    Every generation is scored in one process_population call, on a process
+    pool started once per run when workers > 1, and mutation moves a site to
+    one of its Voronoi neighbours (see Candidates.get_all_neighbours).
+    """
+
+    def __init__(self, candidates, dwellings, n_sites, pop_size=100, crossover_rate=0.9, mutation_rate=None,
+                 neighbour_dist=2, workers=None, engine=None, seed=None):
+        """
+        Attributes:
+            candidates (Candidates): Candidates with load_data() already run.
+            dwellings (Dwellings): Dwellings with load_data() already run.
+            n_sites (int): Number of sites in every build.
+            pop_size (int): Number of individuals per generation.
+            crossover_rate (float): Probability that a child mixes two parents.
+            mutation_rate (float or None): Probability of moving each site,
+                                           defaults to 1 / n_sites.
+            neighbour_dist (float): 'dist' passed to get_all_neighbours.
+            workers (int or None): Processes used by process_population.
+            engine (SparseObjective or None): Optional evaluation engine.
+            seed (int or None): Seed of the random generator.
+        """
+        self.candidates = candidates
+        self.dwellings = dwellings
+        self.n_sites = n_sites
+        self.pop_size = pop_size
+        self.crossover_rate = crossover_rate
+        self.mutation_rate = mutation_rate if mutation_rate is not None else 1 / n_sites
+        self.workers = workers
+        self.engine = engine
+        self.pool = None
+        self.rng = np.random.default_rng(seed)
+
+        if candidates.kdtree is None:
+            candidates.get_voronoi()
+        self.ids = candidates.candidate_ids
+        indptr, neighbours = candidates.get_all_neighbours(neighbour_dist)
+        self.neighbour_indptr = indptr
+        self.neighbour_rows = np.array([candidates.row_of[n] for n in neighbours.tolist()], dtype=np.int64)
+
+        self.population = None   # (pop_size, n_sites) array of candidate rows
+        self.objectives = None   # (pop_size, 3) array of totals
+        self.generation = 0
+        self.history = []
+
+    # ------------------------------------------------------------------ helpers
+
+    def evaluate(self, population):
+        builds = [self.ids[individual].tolist() for individual in population]
+        return process_population(self.candidates, self.dwellings, builds, workers=self.workers, engine=self.engine,
+                                  pool=self.pool)
+
+    def random_population(self, size):
+        return np.array([self.rng.choice(len(self.ids), self.n_sites, replace=False) for _ in range(size)])
+
+    def tournament(self, ranks, crowding, size):
+        # Binary tournament on (rank, crowding distance)
+        a = self.rng.integers(len(ranks), size=size)
+        b = self.rng.integers(len(ranks), size=size)
+        a_wins = (ranks[a] < ranks[b]) | ((ranks[a] == ranks[b]) & (crowding[a] >= crowding[b]))
+        return np.where(a_wins, a, b)
+
+    def crossover(self, parent_a, parent_b):
+        if self.rng.random() >= self.crossover_rate:
+            return parent_a.copy()
+        # Children inherit sites from the union of both parents
+        pool = np.union1d(parent_a, parent_b)
+        return self.rng.choice(pool, self.n_sites, replace=False)
+
+    def mutate(self, individual):
+        chosen = set(individual.tolist())
+        for position in np.flatnonzero(self.rng.random(self.n_sites) < self.mutation_rate):
+            row = individual[position]
+            options = [n for n in self.neighbour_rows[self.neighbour_indptr[row]:self.neighbour_indptr[row + 1]].tolist()
+                       if n not in chosen]
+            if not options:
+                options = [n for n in self.rng.integers(len(self.ids), size=8).tolist() if n not in chosen]
+            if options:
+                new = options[self.rng.integers(len(options))]
+                chosen.discard(row)
+                chosen.add(new)
+                individual[position] = new
+        return individual
+
+    def select(self, population, objectives):
+        ranks = fast_non_dominated_sort(objectives)
+        crowding = crowding_distance(objectives, ranks)
+        order = np.lexsort((-crowding, ranks))[:self.pop_size]
+        return population[order], objectives[order]
+
+    # ------------------------------------------------------------------ checkpoints
+
+    def save_checkpoint(self, path):
+        """
+        Writes the current population, scores and random state to a .npz file.
+        """
+        path = Path(path)
+        temp_path = path.with_name(path.name + '.tmp.npz')
+        np.savez(temp_path, population=self.population, objectives=self.objectives,
+                 generation=self.generation, rng_state=json.dumps(self.rng.bit_generator.state),
+                 history=np.array(self.history, dtype=np.float64).reshape(-1, 2))
+        os.replace(temp_path, path)
+
+    def load_checkpoint(self, path):
+        """
+        Restores a run saved with save_checkpoint().
+        """
+        with np.load(path) as data:
+            self.population = data['population']
+            self.objectives = data['objectives']
+            self.generation = int(data['generation'])
+            self.rng.bit_generator.state = json.loads(str(data['rng_state']))
+            self.history = [tuple(row) for row in data['history'].tolist()]
+
+    # ------------------------------------------------------------------ main loop
+
+    def run(self, generations, initial_builds=None, checkpoint=None, checkpoint_every=10, resume=False, verbose=False):
+        """
+        Evolves the population until 'generations' generations have run.
+
+        Args:
+            generations (int): Total number of generations (including any
+                               already run when resuming).
+            initial_builds (list or None): Builds used to seed the first
+                                           population, e.g. a greedy solution.
+            checkpoint (Path or None): File the run is saved to.
+            checkpoint_every (int): Generations between checkpoints.
+            resume (bool): Continue from 'checkpoint' if it exists.
+            verbose (bool): Print progress every generation.
+
+        Returns:
+            tuple: (builds, objectives) of the final Pareto front.
+        """
+        if self.workers is None or self.workers <= 1:
+            return self._evolve(generations, initial_builds, checkpoint, checkpoint_every, resume, verbose)
+
+        # Every generation reuses the same workers, so the data is sent once
+        with population_pool(self.candidates, self.dwellings, self.workers, self.engine) as pool:
+            self.pool = pool
+            try:
+                return self._evolve(generations, initial_builds, checkpoint, checkpoint_every, resume, verbose)
+            finally:
+                self.pool = None
+
+    def _evolve(self, generations, initial_builds, checkpoint, checkpoint_every, resume, verbose):
+        if resume and checkpoint is not None and Path(checkpoint).exists():
+            self.load_checkpoint(checkpoint)
+        elif self.population is None:
+            population = self.random_population(self.pop_size)
+            for k, build in enumerate((initial_builds or [])[:self.pop_size]):
+                population[k] = [self.candidates.row_of[site] for site in build]
+            self.population = population
+            self.objectives = self.evaluate(population)
+
+        while self.generation < generations:
+            start = time.perf_counter()
+            ranks = fast_non_dominated_sort(self.objectives)
+            crowding = crowding_distance(self.objectives, ranks)
+            parents = self.tournament(ranks, crowding, 2 * self.pop_size)
+
+            offspring = np.array([self.mutate(self.crossover(self.population[a], self.population[b]))
+                                  for a, b in parents.reshape(-1, 2)])
+            offspring_objectives = self.evaluate(offspring)
+
+            self.population, self.objectives = self.select(np.concatenate([self.population, offspring]),
+                                                           np.concatenate([self.objectives, offspring_objectives]))
+            self.generation += 1
+            elapsed = time.perf_counter() - start
+            self.history.append((self.generation, elapsed))
+            if verbose:
+                print(f'generation {self.generation}: {1 / elapsed:.2f} generations/s, '
+                      f'best {self.objectives.max(axis=0)}')
+
+            if checkpoint is not None and (self.generation % checkpoint_every == 0 or self.generation == generations):
+                self.save_checkpoint(checkpoint)
+
+        return self.pareto_front()
+
+    def pareto_front(self):
+        """
+        Returns the builds and objectives of the current non-dominated set.
+        """
+        front = fast_non_dominated_sort(self.objectives) == 0
+        builds = [self.ids[individual].tolist() for individual in self.population[front]]
+        return builds, self.objectives[front]
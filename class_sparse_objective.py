@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse candidate-by-pixel representation of the objective function.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+import instrumentation
+
+
+class SparseObjective:
+    """
+    Holds the candidate rasters as a sparse candidate-by-populated-pixel matrix.
+
+    Only pixels with dwellings or a non-zero isolation value are kept as
+    columns, and only the non-zero reduction/coverage values of each candidate
+    are stored. Evaluating a build then becomes a gather of the selected rows,
+    a per-column max and a dot product with the pixel weights, which returns
+    the same totals as obj_func_code.process_raster.
+    """
+
+    def __init__(self, ids, indptr, indices, reduction, coverage, pixels, dwellings, isolation, shape):
+        """
+        Attributes:
+            ids (np.ndarray): Candidate IDs, one per matrix row.
+            indptr (np.ndarray): CSR row pointer shared by both layers.
+            indices (np.ndarray): CSR column index (position in 'pixels').
+            reduction (np.ndarray): Non-zero reduction values.
+            coverage (np.ndarray): Coverage values at the same positions.
+            pixels (np.ndarray): Flat index into the main raster of every column.
+            dwellings (np.ndarray): Dwelling count of every column.
+            isolation (np.ndarray): Isolation value of every column.
+            shape (tuple): (main_height, main_width) of the main raster.
+        """
+        self.ids = np.asarray(ids)
+        self.indptr = np.asarray(indptr)
+        self.indices = np.asarray(indices)
+        self.reduction = np.asarray(reduction)
+        self.coverage = np.asarray(coverage)
+        self.pixels = np.asarray(pixels)
+        self.dwellings = np.asarray(dwellings)
+        self.isolation = np.asarray(isolation)
+        self.shape = tuple(int(s) for s in shape)
+        self.row_of = {candidate: row for row, candidate in enumerate(self.ids.tolist())}
+
+    @classmethod
+    def build(cls, candidates, dwellings):
+        """
+        Builds the sparse matrix from loaded Candidates and Dwellings objects.
+
+        Args:
+            candidates (Candidates): Candidates with load_data() already run.
+            dwellings (Dwellings): Dwellings with load_data() already run.
+
+        Returns:
+            SparseObjective: The engine covering every loaded candidate.
+        """
+        main_height, main_width = dwellings.main_height, dwellings.main_width
+
+        # --- STEP 1: Keep only pixels that can contribute to an objective ---
+        index = dwellings.pixel_index if dwellings.pixel_index is not None else dwellings.build_index()
+        pixels = index['flat']
+
+        # --- STEP 2: Collect the non-zero entries of every candidate window ---
+        ids = list(candidates.candidate_data.keys())
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        indices, reduction, coverage = [], [], []
+
+        for row, candidate in enumerate(ids):
+            data = candidates.candidate_data[candidate]
+            window = data['window']
+            rows = np.arange(window.row_off, window.row_off + window.height)
+            cols = np.arange(window.col_off, window.col_off + window.width)
+            flat = (rows[:, None] * main_width + cols[None, :]).ravel()
+
+            # Decode compact layers so the engine always stores float values
+            red = (np.asarray(data['reduction'], dtype=np.float32) * np.float32(candidates.layer_scale['reduction'])).ravel()
+            cov = (np.asarray(data['coverage'], dtype=np.float32) * np.float32(candidates.layer_scale['coverage'])).ravel()
+            # Column of every window pixel via the sorted populated-pixel index
+            column = np.searchsorted(pixels, flat)
+            populated = column < pixels.size
+            populated[populated] = pixels[column[populated]] == flat[populated]
+            keep = populated & ((red > 0) | (cov > 0))
+
+            indices.append(column[keep])
+            reduction.append(np.where(red[keep] > 0, red[keep], 0))
+            coverage.append(np.where(cov[keep] > 0, cov[keep], 0))
+            indptr[row + 1] = indptr[row] + np.count_nonzero(keep)
+
+        return cls(
+            ids=np.array(ids),
+            indptr=indptr,
+            indices=np.concatenate(indices).astype(np.int32) if indices else np.zeros(0, dtype=np.int32),
+            reduction=np.concatenate(reduction) if reduction else np.zeros(0, dtype=np.float32),
+            coverage=np.concatenate(coverage) if coverage else np.zeros(0, dtype=np.float32),
+            pixels=pixels,
+            dwellings=index['counts'],
+            isolation=index['isolation'],
+            shape=(main_height, main_width),
+        )
+
+    def save(self, path):
+        """
+        Saves the engine to a single .npz file.
+        """
+        np.savez(path, ids=self.ids, indptr=self.indptr, indices=self.indices,
+                 reduction=self.reduction, coverage=self.coverage, pixels=self.pixels,
+                 dwellings=self.dwellings, isolation=self.isolation, shape=np.array(self.shape))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an engine previously written by save().
+        """
+        with np.load(path) as data:
+            return cls(**{key: data[key] for key in data.files})
+
+    def reduction_matrix(self):
+        """
+        Returns the reduction layer as a scipy CSR matrix (candidates x pixels).
+        """
+        return csr_matrix((self.reduction, self.indices, self.indptr), shape=(self.ids.size, self.pixels.size))
+
+    def coverage_matrix(self):
+        """
+        Returns the coverage layer as a scipy CSR matrix (candidates x pixels).
+        """
+        return csr_matrix((self.coverage, self.indices, self.indptr), shape=(self.ids.size, self.pixels.size))
+
+    @instrumentation.timed('SparseObjective.process_raster')
+    def process_raster(self, selected_raster_numbers):
+        """
+        Computes the reduction, coverage and fairness totals of a build.
+
+        Drop-in replacement for obj_func_code.process_raster once the engine
+        has been built, returning the same three totals.
+        """
+        # --- STEP 1: Gather the entries of the selected rows ---
+        rows = [self.row_of[raster_number] for raster_number in dict.fromkeys(selected_raster_numbers)]
+        if not rows:
+            return 0.0, 0.0, 0.0
+        parts = [slice(self.indptr[row], self.indptr[row + 1]) for row in rows]
+        columns = np.concatenate([self.indices[part] for part in parts])
+        reduction = np.concatenate([self.reduction[part] for part in parts])
+        coverage = np.concatenate([self.coverage[part] for part in parts])
+        if columns.size == 0:
+            return 0.0, 0.0, 0.0
+        if instrumentation.ENABLED:
+            instrumentation.count('evaluations')
+            instrumentation.count('pixels_touched', columns.size)
+
+        # --- STEP 2: Per-column max over the selected candidates ---
+        order = np.argsort(columns, kind='stable')
+        columns = columns[order]
+        starts = np.flatnonzero(np.r_[True, columns[1:] != columns[:-1]])
+        reduction = np.maximum.reduceat(reduction[order], starts)
+        coverage = np.maximum.reduceat(coverage[order], starts)
+        columns = columns[starts]
+
+        # --- STEP 3: Weight by dwellings and isolation ---
+        total_sum_reduction = np.dot(reduction, self.dwellings[columns])
+        total_sum_coverage = np.dot(coverage, self.dwellings[columns])
+        total_sum_fairness = np.dot(coverage, self.isolation[columns])
+
+        return total_sum_reduction, total_sum_coverage, total_sum_fairness
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+Resident evaluation server holding the candidate and dwelling data in
+shared memory.
+
+The server loads the data once, copies every array into
+multiprocessing.shared_memory blocks and answers scoring and neighbour
+queries over a localhost TCP socket (one JSON object per line). Clients on
+the same machine either send builds to the server, or attach the shared
+blocks read-only and call process_raster locally without loading or copying
+anything. Start it with:
+
+    python evaluation_server.py data --port 8765
+"""
+
+import argparse
+import copy
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+import numpy as np
+from rasterio.windows import Window
+from class_candidates import Candidates
+from class_dwellings import Dwellings
+from obj_func_code import default_time_penalty, process_population, process_raster
+
+# Hosts the server may bind to; it is never exposed beyond this machine
+LOCAL_HOSTS = ('127.0.0.1', 'localhost')
+
+DEFAULT_PORT = 8765
+
+# Names of the shared memory blocks created by this process
+_created_blocks = set()
+
+
+def _share(array):
+    # Copies an array into a new shared memory block
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    _created_blocks.add(block.name)
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, view
+
+
+def _attach(name):
+    # Attaches an existing block without registering it with this process's
+    # resource tracker, which would otherwise unlink it when the client exits
+    block = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix' and name not in _created_blocks:
+        resource_tracker.unregister(block._name, 'shared_memory')
+    return block
+
+
+class SharedData:
+    """
+    Read-only view of the data shared by an EvaluationServer.
+
+    Carries the attributes process_raster reads from both a Candidates and
+    a Dwellings object, so it can be passed as either argument:
+
+        shared = client.attach()
+        process_raster(shared, shared, build)
+    """
+
+    def __init__(self, layout):
+        """
+        Attributes:
+            main_data, isolation_data (np.ndarray): Dwelling rasters.
+            candidate_data (dict): Candidate ID to {'window', 'reduction',
+                                   'coverage', 'time'} with array views.
+            layer_scale (dict): Decoding factor of each candidate layer.
+            time_penalty (float): Travel time of unserved dwellings.
+        """
+        self.blocks = []
+        self.main_data = self._view(layout['main_data'])
+        self.isolation_data = self._view(layout['isolation_data'])
+        self.main_height, self.main_width = self.main_data.shape
+        self.total_dwellings = layout['total_dwellings']
+        self.layer_scale = layout['layer_scale']
+        self.time_penalty = layout['time_penalty']
+        self.pyramid = None
+
+        layers = {layer: self._view(spec) for layer, spec in layout['layers'].items()}
+        offsets = layout['patch_offsets']
+        self.candidate_data = dict()
+        for i, (candidate, window, shape) in enumerate(zip(layout['ids'], layout['windows'], layout['shapes'])):
+            row_off, col_off, height, width = window
+            entry = {'window': Window(col_off, row_off, width, height)}
+            for layer, section in layers.items():
+                entry[layer] = section[offsets[i]:offsets[i + 1]].reshape(shape)
+            self.candidate_data[candidate] = entry
+
+    def _view(self, spec):
+        block = _attach(spec['name'])
+        self.blocks.append(block)
+        view = np.ndarray(tuple(spec['shape']), dtype=np.dtype(spec['dtype']), buffer=block.buf)
+        view.flags.writeable = False
+        return view
+
+    def close(self):
+        # Views must not be used once their blocks are closed
+        self.candidate_data = dict()
+        self.main_data = self.isolation_data = None
+        for block in self.blocks:
+            block.close()
+        self.blocks = []
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    # One JSON request per line, answered with one JSON response per line
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                response = {'ok': True, 'result': self.server.evaluation_server.handle(request)}
+            except Exception as error:
+                response = {'ok': False, 'error': f'{type(error).__name__}: {error}'}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class EvaluationServer:
+    """
+    Serves process_raster-style scoring and neighbour queries from one
+    shared copy of the data.
+    """
+
+    def __init__(self, candidates, dwellings, host='127.0.0.1', port=DEFAULT_PORT):
+        """
+        Copies the loaded data into shared memory and binds the socket.
+
+        The server works on shallow copies of candidates and dwellings whose
+        arrays point at the shared blocks, so the objects passed in are left
+        untouched and stay usable after stop().
+
+        Args:
+            candidates (Candidates): Candidates with load_data() (or
+                                     load_packed()) already run.
+            dwellings (Dwellings): Dwellings with load_data() already run.
+            host (str): Loopback address to listen on.
+            port (int): Port to listen on, 0 picks a free one.
+
+        Raises:
+            ValueError: If host is not a loopback address.
+        """
+        if host not in LOCAL_HOSTS:
+            raise ValueError(f'The evaluation server only listens on localhost, not {host}')
+
+        self.candidates = copy.copy(candidates)
+        self.dwellings = copy.copy(dwellings)
+        self.blocks = []
+        self.layout = self._share_data()
+        self.candidates.get_voronoi()
+
+        self.server = _ThreadingServer((host, port), _RequestHandler)
+        self.server.evaluation_server = self
+        self.thread = None
+
+    @classmethod
+    def from_folder(cls, data_folder, host='127.0.0.1', port=DEFAULT_PORT, workers=None):
+        """
+        Loads a data folder (from its packed candidate store if there is
+        an up-to-date one) and starts a server on it.
+        """
+        data_folder = Path(data_folder)
+        dwellings = Dwellings(data_folder)
+        dwellings.load_data()
+        candidates = Candidates(data_folder)
+        if candidates.is_packed_current():
+            candidates.load_packed()
+        else:
+            candidates.load_data(workers=workers)
+        return cls(candidates, dwellings, host=host, port=port)
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def _shared_spec(self, array):
+        block, view = _share(array)
+        self.blocks.append(block)
+        return view, {'name': block.name, 'dtype': view.dtype.str, 'shape': list(view.shape)}
+
+    def _share_data(self):
+        candidates, dwellings = self.candidates, self.dwellings
+        layout = {'total_dwellings': float(dwellings.total_dwellings),
+                  'layer_scale': dict(candidates.layer_scale),
+                  'time_penalty': float(default_time_penalty(candidates))}
+
+        # --- STEP 1: Dwelling rasters ---
+        dwellings.main_data, layout['main_data'] = self._shared_spec(dwellings.main_data)
+        dwellings.isolation_data, layout['isolation_data'] = self._shared_spec(dwellings.isolation_data)
+
+        # --- STEP 2: Candidate layers, one contiguous block per layer ---
+        ids = list(candidates.candidate_data.keys())
+        shapes = [np.shape(candidates.candidate_data[candidate]['reduction']) for candidate in ids]
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([height * width for height, width in shapes])
+        layout['layers'] = dict()
+        sections = dict()
+        for layer in ('reduction', 'coverage', 'time'):
+            patches = [np.asarray(candidates.candidate_data[candidate][layer]).ravel() for candidate in ids]
+            packed = np.concatenate(patches) if patches else np.zeros(0, dtype=np.float32)
+            sections[layer], layout['layers'][layer] = self._shared_spec(packed)
+
+        # --- STEP 3: Point the server's copies at the shared blocks ---
+        windows = []
+        candidate_data = dict()
+        for i, candidate in enumerate(ids):
+            window = candidates.candidate_data[candidate]['window']
+            windows.append([int(window.row_off), int(window.col_off), int(window.height), int(window.width)])
+            entry = {'window': window}
+            for layer, section in sections.items():
+                entry[layer] = section[offsets[i]:offsets[i + 1]].reshape(shapes[i])
+            candidate_data[candidate] = entry
+        candidates.candidate_data = candidate_data
+
+        layout.update(ids=ids, windows=windows, shapes=[list(shape) for shape in shapes],
+                      patch_offsets=offsets.tolist())
+        return layout
+
+    # ------------------------------------------------------------------ requests
+
+    def handle(self, request):
+        """
+        Answers one request, e.g. {'method': 'process_raster', 'build': [...]}.
+
+        Methods:
+            ping: Number of candidates served.
+            layout: Shared memory layout for SharedData.
+            process_raster: Totals of 'build' (optionally 'travel_time').
+            process_population: Totals of every build in 'builds'.
+            get_nearest_neighbours: [id, [x, y]] pairs around 'site' within
+                                    'dist' (see Candidates).
+        """
+        method = request.get('method')
+        if method == 'ping':
+            return {'candidates': len(self.layout['ids'])}
+        if method == 'layout':
+            return self.layout
+        if method == 'process_raster':
+            totals = process_raster(self.candidates, self.dwellings, request['build'],
+                                    travel_time=request.get('travel_time', False))
+            return [float(total) for total in totals]
+        if method == 'process_population':
+            scores = process_population(self.candidates, self.dwellings, request['builds'],
+                                        travel_time=request.get('travel_time', False))
+            return scores.tolist()
+        if method == 'get_nearest_neighbours':
+            neighbours = self.candidates.get_nearest_neighbours(request['site'], request['dist'])
+            return [[site, coordinates] for site, coordinates in neighbours.items()]
+        raise ValueError(f'Unknown method {method!r}')
+
+    # ------------------------------------------------------------------ lifetime
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        """
+        Serves requests from a background thread.
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving and frees the shared memory (attached clients must
+        close their SharedData first). When serving in the foreground, call
+        it after serve_forever() has returned.
+        """
+        if self.thread is not None:
+            self.server.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server.server_close()
+        self.candidates.candidate_data = dict()
+        self.dwellings.main_data = self.dwellings.isolation_data = None
+        for block in self.blocks:
+            _created_blocks.discard(block.name)
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+class EvaluationClient:
+    """
+    Thin client of an EvaluationServer, keeping one connection open.
+    """
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, timeout=None):
+        self.connection = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.connection.makefile('rb')
+        self.lock = threading.Lock()
+        self.shared = None
+
+    def request(self, method, **params):
+        """
+        Sends one request and returns its result.
+
+        Raises:
+            RuntimeError: If the server could not answer the request.
+        """
+        with self.lock:
+            self.connection.sendall(json.dumps({'method': method, **params}).encode() + b'\n')
+            line = self.reader.readline()
+        if not line:
+            raise ConnectionError('The evaluation server closed the connection')
+        response = json.loads(line)
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    def process_raster(self, selected_raster_numbers, travel_time=False):
+        return tuple(self.request('process_raster', build=list(selected_raster_numbers), travel_time=travel_time))
+
+    def process_population(self, list_of_builds, travel_time=False):
+        scores = self.request('process_population', builds=[list(build) for build in list_of_builds],
+                              travel_time=travel_time)
+        return np.array(scores, dtype=np.float64).reshape(len(list_of_builds), 4 if travel_time else 3)
+
+    def get_nearest_neighbours(self, location, dist):
+        return {site: coordinates for site, coordinates in
+                self.request('get_nearest_neighbours', site=location, dist=dist)}
+
+    def attach(self):
+        """
+        Maps the server's shared memory into this process.
+
+        Returns:
+            SharedData: Usable as both the candidates and dwellings argument
+                        of process_raster and process_population.
+        """
+        if self.shared is None:
+            self.shared = SharedData(self.request('layout'))
+        return self.shared
+
+    def close(self):
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+        self.reader.close()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve objective evaluations on localhost.')
+    parser.add_argument('data_folder', type=Path, help='folder holding the dwelling and candidate data')
+    parser.add_argument('--host', default='127.0.0.1', choices=LOCAL_HOSTS)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=None, help='threads reading the candidate rasters')
+    args = parser.parse_args()
+
+    server = EvaluationServer.from_folder(args.data_folder, host=args.host, port=args.port, workers=args.workers)
+    host, port = server.address
+    print(f'Serving {len(server.layout["ids"])} candidates on {host}:{port} (Ctrl+C to stop)')
+    # Free the shared memory when stopped by a process manager as well
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
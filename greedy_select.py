@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy-greedy (CELF) site selection.
+"""
+
+import heapq
+import numpy as np
+
+# Weights applied to (reduction, coverage, fairness) for each named objective
+OBJECTIVE_WEIGHTS = {
+    'reduction': (1.0, 0.0, 0.0),
+    'coverage': (0.0, 1.0, 0.0),
+    'fairness': (0.0, 0.0, 1.0),
+}
+
+
+def greedy_select(candidates, dwellings, k, objective='coverage', pool=None):
+    """
+    Selects k sites with the lazy-greedy (CELF) algorithm.
+
+    The max-composite reduction, coverage and fairness totals are monotone
+    submodular in the set of built sites, so a site's marginal gain can only
+    shrink as the build grows. Stale gains are therefore kept in a priority
+    queue and a site is only re-scored when it reaches the top, which gives
+    the same result as plain greedy (within (1 - 1/e) of the optimum) with
+    far fewer evaluations. Each evaluation only touches the site's window.
+
+    Args:
+        candidates (Candidates): Candidates with load_data() already run.
+        dwellings (Dwellings): Dwellings with load_data() already run.
+        k (int): Number of sites to select.
+        objective (str or tuple): 'reduction', 'coverage', 'fairness' or
+                                  non-negative weights for the three totals.
+        pool (list or None): Candidate IDs to choose from, defaults to all.
+
+    Returns:
+        tuple: (selected, gains) - the candidate IDs in selection order and
+               the marginal gain of each one.
+    """
+    w_reduction, w_coverage, w_fairness = OBJECTIVE_WEIGHTS[objective] if isinstance(objective, str) else objective
+
+    shape = (dwellings.main_height, dwellings.main_width)
+    composite_reduction = np.zeros(shape, dtype=np.float32)
+    composite_coverage = np.zeros(shape, dtype=np.float32)
+    scale = candidates.layer_scale
+
+    def window_of(site):
+        window = candidates.candidate_data[site]['window']
+        return (slice(window.row_off, window.row_off + window.height),
+                slice(window.col_off, window.col_off + window.width))
+
+    def patches(site):
+        data = candidates.candidate_data[site]
+        reduction = np.nan_to_num(np.asarray(data['reduction'], dtype=np.float32) * np.float32(scale['reduction']))
+        coverage = np.nan_to_num(np.asarray(data['coverage'], dtype=np.float32) * np.float32(scale['coverage']))
+        return reduction, coverage
+
+    def gain(site):
+        window = window_of(site)
+        reduction, coverage = patches(site)
+        extra_reduction = np.maximum(reduction - composite_reduction[window], 0)
+        extra_coverage = np.maximum(coverage - composite_coverage[window], 0)
+        total = 0.0
+        if w_reduction:
+            total += w_reduction * np.sum(extra_reduction * dwellings.main_data[window], dtype=np.float64)
+        if w_coverage:
+            total += w_coverage * np.sum(extra_coverage * dwellings.main_data[window], dtype=np.float64)
+        if w_fairness:
+            total += w_fairness * np.sum(extra_coverage * dwellings.isolation_data[window], dtype=np.float64)
+        return float(total)
+
+    # --- STEP 1: Score every site on its own ---
+    pool = list(candidates.candidate_data.keys()) if pool is None else list(pool)
+    # Heap entries: (-gain, tie-break, site, round the gain was computed in)
+    heap = [(-gain(site), order, site, 0) for order, site in enumerate(pool)]
+    heapq.heapify(heap)
+
+    # --- STEP 2: Lazy greedy ---
+    selected, gains = [], []
+    while heap and len(selected) < k:
+        negative_gain, order, site, computed_in = heapq.heappop(heap)
+        if computed_in == len(selected):
+            # Fresh gain on top of the queue: no other site can beat it
+            selected.append(site)
+            gains.append(-negative_gain)
+            window = window_of(site)
+            reduction, coverage = patches(site)
+            np.maximum(composite_reduction[window], reduction, out=composite_reduction[window])
+            np.maximum(composite_coverage[window], coverage, out=composite_coverage[window])
+        else:
+            heapq.heappush(heap, (-gain(site), order, site, len(selected)))
+
+    return selected, gains
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in timers, counters and memory peaks for the loading and evaluation
+hot paths.
+
+Instrumentation is off by default and every hook then costs a single flag
+check. Typical use:
+
+    import instrumentation
+    instrumentation.enable(memory=True)
+    ...  # load data, run the optimiser
+    instrumentation.save_report('profile.json')
+    instrumentation.save_trace('profile.folded')
+
+Stages nest, so each timing is recorded under its full call path (e.g.
+'process_population;process_raster;composite'). The trace is written in the
+folded-stack format read by flamegraph.pl and speedscope, with each path's
+self time in microseconds. Stages are tracked per thread; work done inside
+process-pool workers is not collected.
+"""
+
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import nullcontext
+
+# Checked by every hook; only change it through enable() and disable()
+ENABLED = False
+
+_NULL_STAGE = nullcontext()
+_lock = threading.Lock()
+_local = threading.local()
+_stages = dict()                 # call path -> [calls, total_s, self_s, peak_bytes, growth_bytes]
+_counters = defaultdict(int)
+_snapshots = []
+_memory = {'trace': False, 'started': False}
+
+
+def enable(memory=False):
+    """
+    Clears earlier results and starts recording.
+
+    Args:
+        memory (bool): Also record the peak traced memory of every stage
+                       (starts tracemalloc, which slows Python code down).
+    """
+    global ENABLED
+    reset()
+    _memory['trace'] = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _memory['started'] = True
+    ENABLED = True
+
+
+def disable():
+    """
+    Stops recording; results stay available until reset() or enable().
+    """
+    global ENABLED
+    ENABLED = False
+    if _memory['started']:
+        tracemalloc.stop()
+        _memory['started'] = False
+    _memory['trace'] = False
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _snapshots.clear()
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+class _Stage:
+    """
+    Context manager timing one stage, see stage().
+    """
+
+    __slots__ = ('name', 'path', 'start', 'child_time', 'peak', 'base')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = _stack()
+        self.path = stack[-1].path + (self.name,) if stack else (self.name,)
+        self.child_time = 0.0
+        self.peak = self.base = 0
+        if _memory['trace']:
+            # The peak so far belongs to the parent; restart it for this stage
+            self.base, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        stack = _stack()
+        stack.pop()
+        if _memory['trace'] and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if stack:
+            stack[-1].child_time += elapsed
+            stack[-1].peak = max(stack[-1].peak, self.peak)
+
+        with _lock:
+            entry = _stages.setdefault(self.path, [0, 0.0, 0.0, 0, 0])
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += elapsed - self.child_time
+            entry[3] = max(entry[3], self.peak)
+            entry[4] = max(entry[4], self.peak - self.base)
+        return False
+
+
+def stage(name):
+    """
+    Returns a context manager timing the enclosed block as 'name'.
+    """
+    if not ENABLED:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as the stage 'name'.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with _Stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """
+    Adds n to the counter 'name' (e.g. 'files_opened', 'bytes_read').
+    """
+    if ENABLED:
+        with _lock:
+            _counters[name] += n
+
+
+def snapshot(label):
+    """
+    Records the current and peak traced memory under a label.
+    """
+    if ENABLED and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        with _lock:
+            _snapshots.append({'label': label, 'time': time.time(),
+                               'current_mb': current / 2 ** 20, 'peak_mb': peak / 2 ** 20})
+
+
+def report():
+    """
+    Returns everything recorded so far.
+
+    Returns:
+        dict: 'stages' (per call path, slowest first: calls, total and self
+              seconds, mean milliseconds, peak traced MB and the largest
+              growth in MB over the memory in use when the stage started),
+              'counters' and 'snapshots'.
+    """
+    with _lock:
+        stages = [{
+            'stage': ';'.join(path),
+            'calls': calls,
+            'total_s': total,
+            'self_s': own,
+            'mean_ms': 1000 * total / calls,
+            'peak_mb': peak / 2 ** 20,
+            'growth_mb': growth / 2 ** 20,
+        } for path, (calls, total, own, peak, growth) in _stages.items()]
+        counters = dict(_counters)
+        snapshots = list(_snapshots)
+    stages.sort(key=lambda entry: entry['total_s'], reverse=True)
+    return {'stages': stages, 'counters': counters, 'snapshots': snapshots}
+
+
+def save_report(path):
+    """
+    Writes report() to a JSON file.
+    """
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+
+
+def save_trace(path):
+    """
+    Writes the stage timings as folded stacks ('a;b;c <microseconds>'), one
+    line per call path, for flamegraph.pl or speedscope.
+    """
+    with _lock:
+        lines = [f"{';'.join(path)} {round(entry[2] * 1e6)}" for path, entry in _stages.items()]
+    with open(path, 'w') as f:
+        f.write('\n'.join(sorted(lines)) + '\n')
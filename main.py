@@ -10,35 +10,29 @@ from class_candidates import Candidates
 from obj_func_code import process_raster
 from plots import plot_result_with_map, plot_dwellings, plot_candidates, plot_candidate_raster  # Custom plotting function
 from pathlib import Path
-from zipfile import ZipFile
 
 #%% Set working directory and define data paths
 cwd = Path.cwd()  # or your specific project path
 data_folder = cwd / "data" 
 
-temp_data_folder = cwd / "data" / "temp_data"
 plots_folder = cwd / "plots" 
 
 folder_names = ["v_b", "v_i", "v_t"]
 
+# Candidate rasters are read straight from the zip archives when the folders
+# have not been extracted, so nothing needs unzipping here
 for name in folder_names:
     folder = data_folder / name
     zip_file = data_folder / f"{name}.zip"
 
     if folder.exists():
         print(f"✅ Folder exists: {folder}")
-        continue
-
-    if zip_file.exists():
-        print(f"📦 Unzipping: {zip_file.name} …")
-        with ZipFile(zip_file, "r") as z:
-            z.extractall(data_folder)
-        print(f"✅ Unzipped → {folder}")
+    elif zip_file.exists():
+        print(f"📦 Reading from archive: {zip_file.name}")
     else:
         print(f"❌ Neither folder nor zip found for: {name}")
 
 # Check if it exists, create if not
-temp_data_folder.mkdir(parents=True, exist_ok=True)
 plots_folder.mkdir(parents=True, exist_ok=True)
 
 #%%
@@ -49,8 +43,15 @@ plot_dwellings(dwellings)
 candidates = Candidates(data_folder)
 plot_candidates(candidates)
 
-# This may take a few mins
-candidates.load_data()
+# The first run reads every candidate GeoTIFF (this may take a few mins) and
+# packs them into a memory-mapped store; later runs load the store instead,
+# until the archives or GeoTIFFs change and the store is rebuilt
+packed_folder = data_folder / "candidates_packed"
+if candidates.is_packed_current(packed_folder):
+    candidates.load_packed(packed_folder)
+else:
+    candidates.load_data()
+    candidates.pack_data(packed_folder)
 
 #%%
 
@@ -6,44 +6,262 @@ Created on Fri May 16 14:09:28 2025
 """
 
 import numpy as np           
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import instrumentation
               
 
+@instrumentation.timed('create_blank_raster')
 def create_blank_raster(main_extent, main_transform, main_width, main_height):
     dtype = np.float32  # Adjust dtype if needed
     blank_raster = np.zeros((main_height, main_width), dtype=dtype)
+    instrumentation.count('blank_raster_bytes', blank_raster.nbytes)
     return blank_raster
                    
-def process_raster(candidates, dwellings, selected_raster_numbers):
-    # Load main raster extent and create blank raster
-    composite_raster_reduction = create_blank_raster(dwellings.main_extent, dwellings.main_transform, dwellings.main_width, dwellings.main_height)
-    composite_raster_coverage = create_blank_raster(dwellings.main_extent, dwellings.main_transform, dwellings.main_width, dwellings.main_height)
-    
-    # Iterate through selected raster numbers
-    for raster_number in selected_raster_numbers:
-        window = candidates.candidate_data[raster_number]['window']
-        candidate_raster_reduction = candidates.candidate_data[raster_number]['reduction']
-        blank_raster_reduction = create_blank_raster(dwellings.main_extent, dwellings.main_transform, dwellings.main_width, dwellings.main_height)
-        blank_raster_reduction[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width] = candidate_raster_reduction
-        
-        composite_raster_reduction = np.where(blank_raster_reduction > composite_raster_reduction, blank_raster_reduction, composite_raster_reduction)
-        
-        candidate_raster_coverage = candidates.candidate_data[raster_number]['coverage']
-        blank_raster_coverage = create_blank_raster(dwellings.main_extent, dwellings.main_transform, dwellings.main_width, dwellings.main_height)
-        blank_raster_coverage[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width] = candidate_raster_coverage
-        composite_raster_coverage = np.where(blank_raster_coverage > composite_raster_coverage, blank_raster_coverage, composite_raster_coverage)
-     
-    result_raster_reduction = composite_raster_reduction * dwellings.main_data
-    total_sum_reduction = np.sum(result_raster_reduction)
-    
-    result_raster_coverage = composite_raster_coverage * dwellings.main_data
-    total_sum_coverage = np.sum(result_raster_coverage)
-    
-    result_raster_fairness = composite_raster_coverage * dwellings.isolation_data
-    total_sum_fairness = np.sum(result_raster_fairness)
-    
-        
-    return total_sum_reduction, total_sum_coverage, total_sum_fairness
+def merge_windows(windows):
+    """
+    Groups candidate windows into disjoint bounding boxes.
+
+    Windows that overlap (directly or through a chain of other windows) are
+    merged into a single box, so every pixel touched by the selection lies in
+    exactly one box and boxes can be composited independently.
+
+    Args:
+        windows (list): rasterio Windows aligned to the main raster.
+
+    Returns:
+        list: Boxes as [row_start, row_stop, col_start, col_stop].
+    """
+    boxes = [[w.row_off, w.row_off + w.height, w.col_off, w.col_off + w.width]
+             for w in windows if w.height > 0 and w.width > 0]
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(len(boxes) - 1, i, -1):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+    return boxes
+
+def default_time_penalty(candidates):
+    """
+    Travel time charged to dwellings that no selected site serves.
 
+    Defaults to the slowest served travel time over every loaded candidate,
+    i.e. an unserved dwelling counts as badly off as the worst served one.
+    The value is computed once and kept on candidates.time_penalty; set that
+    attribute to use a different penalty. Computing it reads every
+    candidate, so with lazy loading it loads them all once; set
+    time_penalty first to avoid that.
+    """
+    if candidates.time_penalty is None:
+        slowest = 0.0
+        for data in candidates.candidate_data.values():
+            served = np.nan_to_num(np.asarray(data['coverage'])) > 0
+            if served.any():
+                slowest = max(slowest, float(np.nanmax(np.asarray(data['time'])[served])))
+        candidates.time_penalty = slowest * candidates.layer_scale['time']
+    return candidates.time_penalty
+
+@instrumentation.timed('process_raster')
+def process_raster(candidates, dwellings, selected_raster_numbers, level=0, travel_time=False):
+    """
+    Computes the reduction, coverage and fairness totals of a build.
+
+    Only the pixels inside the selected candidates' windows are visited:
+    overlapping windows are grouped with merge_windows, each group is
+    max-composited into a scratch array the size of its bounding box and
+    weighted by the matching slices of the dwelling and isolation rasters.
+    Pixels outside every window have zero reduction and coverage and so
+    never contribute to the totals. Compact (integer) candidate layers are
+    composited as stored and decoded with candidates.layer_scale at the end.
+
+    With level > 0 the build is scored on that level of the RasterPyramid
+    attached to candidates (see class_raster_pyramid). Reloading the
+    candidates drops the pyramid, so it has to be built again.
+
+    With travel_time=True a fourth total is returned: the dwelling-weighted
+    travel time to the nearest built site (to be minimised). It is a
+    min-composite of the 'time' layer over the pixels each site covers, built
+    in the same pass; dwellings no selected site covers are charged
+    default_time_penalty(candidates), using dwellings.total_dwellings for the
+    pixels outside every window.
+    """
+    if level:
+        if candidates.pyramid is None:
+            raise ValueError('No RasterPyramid is attached to the candidates')
+        candidates = dwellings = candidates.pyramid.level(level)
+
+    # Each site's entry is fetched once, so a lazy cache smaller than the
+    # build does not read any candidate twice
+    entries = {raster_number: candidates.candidate_data[raster_number] for raster_number in selected_raster_numbers}
+    windows = {raster_number: data['window'] for raster_number, data in entries.items()}
+
+    total_sum_reduction = 0.0
+    total_sum_coverage = 0.0
+    total_sum_fairness = 0.0
+    if travel_time:
+        penalty = np.float32(default_time_penalty(candidates))
+        time_scale = np.float32(candidates.layer_scale['time'])
+        total_sum_time = 0.0
+        dwellings_in_windows = 0.0
+
+    boxes = merge_windows(list(windows.values()))
+    if instrumentation.ENABLED:
+        instrumentation.count('evaluations')
+        instrumentation.count('pixels_touched', sum((r1 - r0) * (c1 - c0) for r0, r1, c0, c1 in boxes))
+
+    for row_start, row_stop, col_start, col_stop in boxes:
+        composite_raster_reduction = np.zeros((row_stop - row_start, col_stop - col_start), dtype=np.float32)
+        composite_raster_coverage = np.zeros((row_stop - row_start, col_stop - col_start), dtype=np.float32)
+        if travel_time:
+            composite_raster_time = np.full((row_stop - row_start, col_stop - col_start), penalty, dtype=np.float32)
+
+        with instrumentation.stage('composite'):
+            for raster_number, window in windows.items():
+                if not (row_start <= window.row_off < row_stop and col_start <= window.col_off < col_stop):
+                    continue
+                rows = slice(window.row_off - row_start, window.row_off - row_start + window.height)
+                cols = slice(window.col_off - col_start, window.col_off - col_start + window.width)
+                data = entries[raster_number]
+
+                # fmax ignores NaN in the candidate patch, matching the np.where
+                # comparison the full-raster version used
+                np.fmax(composite_raster_reduction[rows, cols], data['reduction'],
+                        out=composite_raster_reduction[rows, cols])
+                np.fmax(composite_raster_coverage[rows, cols], data['coverage'],
+                        out=composite_raster_coverage[rows, cols])
+                if travel_time:
+                    served = data['coverage'] > 0
+                    np.fmin(composite_raster_time[rows, cols], np.where(served, data['time'] * time_scale, penalty),
+                            out=composite_raster_time[rows, cols])
+
+        with instrumentation.stage('weighted_sum'):
+            main_data = dwellings.main_data[row_start:row_stop, col_start:col_stop]
+            isolation_data = dwellings.isolation_data[row_start:row_stop, col_start:col_stop]
+
+            total_sum_reduction += np.sum(composite_raster_reduction * main_data)
+            total_sum_coverage += np.sum(composite_raster_coverage * main_data)
+            total_sum_fairness += np.sum(composite_raster_coverage * isolation_data)
+            if travel_time:
+                total_sum_time += np.sum(composite_raster_time * main_data, dtype=np.float64)
+                dwellings_in_windows += np.sum(main_data, dtype=np.float64)
+
+    scale = candidates.layer_scale
+    totals = (total_sum_reduction * scale['reduction'], total_sum_coverage * scale['coverage'],
+              total_sum_fairness * scale['coverage'])
+    if travel_time:
+        total_sum_time += float(penalty) * (dwellings.total_dwellings - dwellings_in_windows)
+        totals += (total_sum_time,)
+    return totals
+
+_population_state = {}
+
+def _init_population_worker(candidates, dwellings, engine):
+    # Runs once per pool process so the data is shipped once, not per build
+    _population_state['candidates'] = candidates
+    _population_state['dwellings'] = dwellings
+    _population_state['engine'] = engine
+
+def _evaluate_build(build, level=0, travel_time=False):
+    engine = _population_state['engine']
+    if engine is not None:
+        return engine.process_raster(build)
+    return process_raster(_population_state['candidates'], _population_state['dwellings'], build,
+                          level=level, travel_time=travel_time)
+
+def population_pool(candidates, dwellings, workers, engine=None):
+    """
+    Starts a process pool whose workers hold the candidate and dwelling data
+    (and engine), for reuse across many process_population calls.
+
+    The data is sent to each worker once, when the pool starts. Use the pool
+    as a context manager, or call shutdown() on it when done.
+
+    Returns:
+        ProcessPoolExecutor: Pass it to process_population as 'pool'.
+    """
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_population_worker,
+                               initargs=(candidates, dwellings, engine))
+
+@instrumentation.timed('process_population')
+def process_population(candidates, dwellings, list_of_builds, workers=None, engine=None, chunksize=None, level=0,
+                       travel_time=False, pool=None):
+    """
+    Scores a whole population of builds in one call.
+
+    Builds that select the same set of sites (in any order) are only
+    evaluated once. With workers > 1 the unique builds are split across a
+    process pool whose workers receive the candidate and dwelling data once
+    at start-up. Callers scoring many populations (e.g. one per generation)
+    should start that pool once with population_pool() and pass it in.
+
+    Args:
+        candidates (Candidates): Candidates with load_data() already run.
+        dwellings (Dwellings): Dwellings with load_data() already run.
+        list_of_builds (list): One list of candidate IDs per individual.
+        workers (int or None): Number of processes; None or 1 runs in-process.
+        engine (SparseObjective or None): Optional engine used instead of
+                                          process_raster.
+        chunksize (int or None): Builds sent to a worker per task.
+        level (int): Pyramid level passed to process_raster (0 is native,
+                     the only level the sparse engine supports).
+        travel_time (bool): Also return the travel-time total as a fourth
+                            column (not supported by the sparse engine).
+        pool (ProcessPoolExecutor or None): Pool from population_pool(),
+                                            built on the same candidates,
+                                            dwellings and engine; used
+                                            instead of starting a new one.
+
+    Returns:
+        np.ndarray: (n_individuals, 3) array of reduction, coverage and
+                    fairness totals (4 columns with travel_time), in the
+                    order of list_of_builds.
+
+    Raises:
+        ValueError: If an engine is combined with travel_time or level > 0,
+                    or level > 0 without a RasterPyramid attached.
+    """
+    if travel_time and engine is not None:
+        raise ValueError('The sparse engine does not compute the travel-time objective')
+    if level and engine is not None:
+        raise ValueError('The sparse engine only scores builds at native resolution (level 0)')
+    if level and candidates.pyramid is None:
+        raise ValueError('No RasterPyramid is attached to the candidates')
+    if travel_time:
+        # Resolve the penalty once here rather than in every pool worker
+        default_time_penalty(candidates.pyramid.level(level) if level else candidates)
+
+    keys = [frozenset(build) for build in list_of_builds]
+    unique_builds = {}
+    for key, build in zip(keys, list_of_builds):
+        unique_builds.setdefault(key, list(build))
+    builds = list(unique_builds.values())
+
+    if len(builds) <= 1 or (pool is None and (workers is None or workers <= 1)):
+        if engine is not None:
+            scores = [engine.process_raster(build) for build in builds]
+        else:
+            scores = [process_raster(candidates, dwellings, build, level=level, travel_time=travel_time)
+                      for build in builds]
+    else:
+        if chunksize is None:
+            chunksize = max(1, len(builds) // (4 * (workers or 1)))
+        evaluate = partial(_evaluate_build, level=level, travel_time=travel_time)
+        if pool is not None:
+            scores = list(pool.map(evaluate, builds, chunksize=chunksize))
+        else:
+            with population_pool(candidates, dwellings, workers, engine) as pool:
+                scores = list(pool.map(evaluate, builds, chunksize=chunksize))
+
+    score_of = dict(zip(unique_builds.keys(), scores))
+    return np.array([score_of[key] for key in keys], dtype=np.float64).reshape(len(keys), 4 if travel_time else 3)
+
+@instrumentation.timed('process_raster_for_visulisation')
 def process_raster_for_visulisation(candidates, dwellings, selected_raster_numbers):
     # Load main raster extent and create blank raster
     composite_raster_reduction = create_blank_raster(dwellings.main_extent, dwellings.main_transform, dwellings.main_width, dwellings.main_height)
@@ -51,18 +269,23 @@ def process_raster_for_visulisation(candidates, dwellings, selected_raster_numbe
     
     # Iterate through selected raster numbers
     for raster_number in selected_raster_numbers:
-        window = candidates.candidate_data[raster_number]['window']
-        candidate_raster_reduction = candidates.candidate_data[raster_number]['reduction']
+        data = candidates.candidate_data[raster_number]
+        window = data['window']
+        candidate_raster_reduction = data['reduction']
         blank_raster_reduction = create_blank_raster(dwellings.main_extent, dwellings.main_transform, dwellings.main_width, dwellings.main_height)
         blank_raster_reduction[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width] = candidate_raster_reduction
         
         composite_raster_reduction = np.where(blank_raster_reduction > composite_raster_reduction, blank_raster_reduction, composite_raster_reduction)
         
-        candidate_raster_coverage = candidates.candidate_data[raster_number]['coverage']
+        candidate_raster_coverage = data['coverage']
         blank_raster_coverage = create_blank_raster(dwellings.main_extent, dwellings.main_transform, dwellings.main_width, dwellings.main_height)
         blank_raster_coverage[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width] = candidate_raster_coverage
         composite_raster_coverage = np.where(blank_raster_coverage > composite_raster_coverage, blank_raster_coverage, composite_raster_coverage)
      
+    # Decode compact candidate layers (a no-op for float layers)
+    composite_raster_reduction *= candidates.layer_scale['reduction']
+    composite_raster_coverage *= candidates.layer_scale['coverage']
+
     result_raster_reduction = composite_raster_reduction * dwellings.main_data
     total_sum_reduction = np.sum(result_raster_reduction)
     
@@ -4,87 +4,218 @@ Created on Tue Oct 22 13:18:59 2024
 
 @author: ksearle
 """
-import geopandas as gpd
-from shapely.geometry import Point
-import matplotlib.pyplot as plt
-from matplotlib.colors import BoundaryNorm, ListedColormap, LinearSegmentedColormap
-import contextily as ctx  # For adding basemaps to geographic data plots
 from obj_func_code import process_raster_for_visulisation  # Custom function for raster processing
+from class_candidates import LAYER_FOLDERS
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
 import rasterio  # For working with raster data
-from rasterio.plot import show
 from rasterio.warp import calculate_default_transform, reproject, Resampling
 import numpy as np
-import os
 
-def plot_dwellings(dwellings):
-    
-    fig, ax = plt.subplots(figsize=(10, 10))
-    
-    
-    
-    with rasterio.open(dwellings.main_raster_path) as src:
+# CRS every layer is reprojected to for plotting
+MAP_CRS = 'EPSG:4326'
+
+# Candidate GeoDataFrames already projected to MAP_CRS, keyed by registry
+_candidate_frames = dict()
+
+# Candidate rasters already reprojected to MAP_CRS, keyed by raster path
+_candidate_layers = dict()
+
+# Dwelling and result rasters already reprojected to MAP_CRS, keyed by the
+# data_version of the objects they were computed from (so reloading data
+# into the same objects invalidates them) and bounded to the most recent
+_dwelling_layers = OrderedDict()
+_result_layers = OrderedDict()
+
+# Data shared with render_builds pool workers
+_render_state = dict()
+
+def _load_plotting():
+    # geopandas, matplotlib and contextily are only imported when a
+    # plot is first drawn, so importing this module (or the evaluation core)
+    # stays cheap in headless worker processes
+    global gpd, plt, BoundaryNorm, ListedColormap, LinearSegmentedColormap, ctx, show
+    if 'plt' in globals():
+        return
+    import geopandas as gpd
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import BoundaryNorm, ListedColormap, LinearSegmentedColormap
+    import contextily as ctx  # For adding basemaps to geographic data plots
+    from rasterio.plot import show
+
+def candidate_geodataframe(candidates):
+    """
+    Returns the candidate points as a GeoDataFrame in EPSG:4326, indexed by
+    candidate ID and built straight from the registry arrays.
+
+    The points are projected once per registry and the same frame is
+    returned on later calls.
+    """
+    _load_plotting()
+    registry = candidates.registry
+    cached = _candidate_frames.get(id(registry))
+    if cached is None or cached[0] is not registry:
+        candidate_gdf = gpd.GeoDataFrame(
+            geometry=gpd.points_from_xy(registry.coords[:, 0], registry.coords[:, 1]),
+            index=registry.ids,
+            crs='EPSG:32738'
+        ).to_crs(MAP_CRS)
+        cached = _candidate_frames[id(registry)] = (registry, candidate_gdf)
+    return cached[1]
+
+@lru_cache(maxsize=8)
+def _map_grid(raster_path):
+    # Source grid of a raster and the grid it is reprojected onto
+    with rasterio.open(raster_path) as src:
+        transform, width, height = calculate_default_transform(
+            src.crs, MAP_CRS, src.width, src.height, *src.bounds)
+        return src.crs, src.transform, transform, width, height
+
+def reproject_to_map(array, raster_path):
+    """
+    Reprojects an array on the grid of 'raster_path' to EPSG:4326 in memory.
+
+    Returns:
+        tuple: (reprojected array, its transform).
+    """
+    src_crs, src_transform, transform, width, height = _map_grid(raster_path)
+    reprojected = np.zeros((height, width), dtype=np.float32)
+    reproject(
+        source=np.asarray(array, dtype=np.float32),
+        destination=reprojected,
+        src_transform=src_transform,
+        src_crs=src_crs,
+        dst_transform=transform,
+        dst_crs=MAP_CRS,
+        resampling=Resampling.nearest
+    )
+    return reprojected, transform
+
+def reprojected_candidate(candidates, candidate, layer):
+    """
+    Reads one candidate raster and reprojects it to EPSG:4326 in memory.
+
+    Results are cached per (candidate, layer), so each site is reprojected
+    once however many builds it appears in.
+
+    Args:
+        candidate (int): Candidate ID.
+        layer (str): 'reduction', 'coverage' or 'time'.
+
+    Returns:
+        tuple: (array with nodata masked, its transform).
+    """
+    path = str(candidates.raster_path(LAYER_FOLDERS[layer], candidate))
+    if path in _candidate_layers:
+        return _candidate_layers[path]
+
+    with rasterio.open(path) as src:
         transform, width, height = calculate_default_transform(
-            src.crs, 'EPSG:4326', src.width, src.height, *src.bounds)
-        kwargs = src.meta.copy()
-        kwargs.update({
-            'crs': 'EPSG:4326',
-            'transform': transform,
-            'width': width,
-            'height': height
-        })
-        
-        # Initialize reprojected raster array
-        reprojected_result_raster = np.empty((height, width), dtype=np.float32)
-        
-        # Perform reprojection
+            src.crs, MAP_CRS, src.width, src.height, *src.bounds)
+        nodata = src.nodata
+        reprojected = np.full((height, width), nodata if nodata is not None else 0, dtype=src.dtypes[0])
         reproject(
-            source=dwellings.main_data,
-            destination=reprojected_result_raster,
+            source=rasterio.band(src, 1),
+            destination=reprojected,
             src_transform=src.transform,
             src_crs=src.crs,
+            src_nodata=nodata,
             dst_transform=transform,
-            dst_crs='EPSG:4326',
-            resampling=Resampling.nearest
-        )
+            dst_crs=MAP_CRS,
+            dst_nodata=nodata,
+            resampling=Resampling.nearest)
 
-    
+    if nodata is None:
+        reprojected = np.ma.masked_array(reprojected)
+    else:
+        reprojected = np.ma.masked_equal(reprojected, nodata)
+    _candidate_layers[path] = (reprojected, transform)
+    return _candidate_layers[path]
+
+def _cached(cache, maxsize, key, compute):
+    # Least recently used cache over one of the layer dicts above
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    cache[key] = value = compute()
+    while len(cache) > maxsize:
+        cache.popitem(last=False)
+    return value
+
+def reprojected_dwellings(dwellings):
+    return _cached(_dwelling_layers, 2, dwellings.data_version,
+                   lambda: reproject_to_map(dwellings.main_data, dwellings.main_raster_path))
+
+def reprojected_result(candidates, dwellings, build):
+    """
+    Composite result raster of a build reprojected to EPSG:4326.
 
+    Cached on the set of sites and the data versions of candidates and
+    dwellings, so the composite is only rebuilt and reprojected when the
+    build changes or either object's data is reloaded.
+
+    Args:
+        build (frozenset): Candidate IDs of the build.
+
+    Returns:
+        tuple: (results, reprojected reduction raster, its transform).
+    """
+    def compute():
+        results, rasters = process_raster_for_visulisation(candidates, dwellings, sorted(build))
+        return (results, *reproject_to_map(rasters[0], dwellings.main_raster_path))
+
+    return _cached(_result_layers, 16, (candidates.data_version, dwellings.data_version, build), compute)
+
+def clear_plot_cache():
+    """
+    Drops every cached reprojection, e.g. after reloading the data.
+    """
+    _candidate_frames.clear()
+    _candidate_layers.clear()
+    _dwelling_layers.clear()
+    _result_layers.clear()
+    _map_grid.cache_clear()
+
+def _plotting_extent(array, transform):
     # Define extent for plotting reprojected rasters
-    raster_extent = [
+    return [
         transform[2], 
-        transform[2] + transform[0] * reprojected_result_raster.shape[1],
-        transform[5] + transform[4] * reprojected_result_raster.shape[0],
+        transform[2] + transform[0] * array.shape[1],
+        transform[5] + transform[4] * array.shape[0],
         transform[5]
     ]
-    
+
+def _result_colormap():
     # Create color map for result raster
     base_cmap1 = LinearSegmentedColormap.from_list('black_to_red', ['red', 'black'])
     base_colors1 = base_cmap1(np.arange(base_cmap1.N))
     alpha_channel1 = np.ones(base_colors1.shape[0])
     alpha_channel1[0] = 0  # Set lowest value to transparent
     base_colors1[:, -1] = alpha_channel1
-    cmap1 = ListedColormap(base_colors1)
+    return ListedColormap(base_colors1)
+
+def plot_dwellings(dwellings):
+    _load_plotting()
+    fig, ax = plt.subplots(figsize=(10, 10))
+    
+    reprojected_result_raster, transform = reprojected_dwellings(dwellings)
     
     # Plot reprojected result raster as a heatmap
     ax.imshow(
-        reprojected_result_raster, cmap=cmap1,
+        reprojected_result_raster, cmap=_result_colormap(),
         norm=BoundaryNorm(boundaries=np.linspace(np.min(reprojected_result_raster), np.max(reprojected_result_raster), 256), ncolors=256),
-        extent=raster_extent, alpha=1,zorder=10 )
+        extent=_plotting_extent(reprojected_result_raster, transform), alpha=1,zorder=10 )
     
     ctx.add_basemap(ax, crs= 'EPSG:4326', zorder=0)
     
     ax.set_title(f'dwellings')
     
 def plot_candidates(candidates):
+    _load_plotting()
  
-    candidate_points = [Point(xy) for xy in candidates.all_candidates.values()]
-    candidate_indices = list(candidates.all_candidates.keys())
-    
-    candidate_gdf = gpd.GeoDataFrame(
-        geometry=candidate_points,
-        index=candidate_indices,
-        crs='EPSG:32738'
-    ).to_crs(epsg=4326)
+    candidate_gdf = candidate_geodataframe(candidates)
     
     fig, ax = plt.subplots(figsize=(10, 10))
     
@@ -98,17 +229,10 @@ def plot_candidates(candidates):
     ax.set_title('candidates')
     
 def plot_candidate_raster(candidates,candidate,raster):
+    _load_plotting()
     
-    map_to_file = {'reduction': 'v_i', 'coverage' : 'v_b', 'time': 'v_t'}
  
-    candidate_points = [Point(xy) for xy in candidates.all_candidates.values()]
-    candidate_indices = list(candidates.all_candidates.keys())
-    
-    candidate_gdf = gpd.GeoDataFrame(
-        geometry=candidate_points,
-        index=candidate_indices,
-        crs='EPSG:32738'
-    ).to_crs(epsg=4326)
+    candidate_gdf = candidate_geodataframe(candidates)
     
     fig, ax = plt.subplots(figsize=(10, 10))
     
@@ -120,66 +244,43 @@ def plot_candidate_raster(candidates,candidate,raster):
     # Add background basemap
     ctx.add_basemap(ax, crs=candidate_gdf.crs.to_string())
     
-    location_tif = candidates.data_file / map_to_file[raster] / f'dry_walk_site_{candidate}.tif'
-    reprojected_tif_path = candidates.data_file / 'temp_data' / f'reprojected_{candidate}.tif'
-
     hold_gdf= gpd.GeoDataFrame(geometry=candidate_gdf.loc[candidate], crs='EPSG:4326')
     hold_gdf.plot(ax=ax, marker='x', color='black', markersize=20, alpha=0.5)
-    with rasterio.open(location_tif) as src:
-        transform, width, height = calculate_default_transform(
-            src.crs, 'EPSG:4326', src.width, src.height, *src.bounds)
-        kwargs = src.meta.copy()
-        kwargs.update({
-            'crs': 'EPSG:4326',
-            'transform': transform,
-            'width': width,
-            'height': height
-        })
-
-        with rasterio.open(reprojected_tif_path, 'w', **kwargs) as dst:
-            for i in range(1, src.count + 1):
-                reproject(
-                    source=rasterio.band(src, i),
-                    destination=rasterio.band(dst, i),
-                    src_transform=src.transform,
-                    src_crs=src.crs,
-                    dst_transform=transform,
-                    dst_crs='EPSG:4326',
-                    resampling=Resampling.nearest)
-
-    # Display the reprojected TIF data on the map
-    with rasterio.open(reprojected_tif_path) as src:
-        show(src, ax=ax, alpha=0.4)
+
+    # Display the reprojected raster on the map
+    reprojected, transform = reprojected_candidate(candidates, candidate, raster)
+    show(reprojected, transform=transform, ax=ax, alpha=0.4)
     
     ax.set_title(f'candidate {candidate} with raster {raster}')
     
     
     
 
-def plot_result_with_map(individual,candidates, dwellings, name):
+def plot_result_with_map(individual,candidates, dwellings, name, output_dir=None, file_format='pdf'):
     """
     Plots geographic information and analysis results over a basemap.
 
     This function generates a map overlay of candidate locations and raster-based analysis results.
     Each individual's data is processed and plotted with relevant transformations to visualize its 
-    geographic impact. 
+    geographic impact. Reprojected rasters are cached in memory, so replotting
+    a build, or a build sharing sites with an earlier one, skips that work.
 
     Parameters:
         individual (list): List of individual locations (typically represented by TIF files) to visualize.
         candidate_manager (CandidateManager): Manager object containing candidate locations and geometry.
+        name (str): File name of the saved map, without extension.
+        output_dir (Path or None): Folder the map is saved in (created if
+                                   needed), defaults to ./plots.
+        file_format (str): File extension, and so format, of the saved map.
+
+    Returns:
+        Path: The saved file.
     """
+    _load_plotting()
     
     # Retrieve and set up candidate GeoDataFrame with required CRS transformations
-    candidate_points = [Point(xy) for xy in candidates.all_candidates.values()]
-    candidate_indices = list(candidates.all_candidates.keys())
+    candidate_gdf = candidate_geodataframe(candidates)
     
-    candidate_gdf = gpd.GeoDataFrame(
-        geometry=candidate_points,
-        index=candidate_indices,
-        crs='EPSG:32738'
-    ).to_crs(epsg=4326)
-    
-    cwd = os.getcwd()
     # Set up the plotting figure and axis
     fig, ax = plt.subplots(figsize=(10, 10))
     
@@ -189,92 +290,97 @@ def plot_result_with_map(individual,candidates, dwellings, name):
     # Add background basemap
     ctx.add_basemap(ax, crs=candidate_gdf.crs.to_string())
     
-    # Process raster data for analysis result
-    results, rasters = process_raster_for_visulisation(candidates, dwellings, individual)
-    
-    # Open and reproject primary result raster to EPSG:4326
-    with rasterio.open(dwellings.main_raster_path) as src:
-        transform, width, height = calculate_default_transform(
-            src.crs, 'EPSG:4326', src.width, src.height, *src.bounds)
-        kwargs = src.meta.copy()
-        kwargs.update({
-            'crs': 'EPSG:4326',
-            'transform': transform,
-            'width': width,
-            'height': height
-        })
-        
-        # Initialize reprojected raster array
-        reprojected_result_raster = np.empty((height, width), dtype=np.float32)
-        
-        # Perform reprojection
-        reproject(
-            source=rasters[0],
-            destination=reprojected_result_raster,
-            src_transform=src.transform,
-            src_crs=src.crs,
-            dst_transform=transform,
-            dst_crs='EPSG:4326',
-            resampling=Resampling.nearest
-        )
-
-    
-
-    # Define extent for plotting reprojected rasters
-    raster_extent = [
-        transform[2], 
-        transform[2] + transform[0] * reprojected_result_raster.shape[1],
-        transform[5] + transform[4] * reprojected_result_raster.shape[0],
-        transform[5]
-    ]
-    
-    # Create color map for result raster
-    base_cmap1 = LinearSegmentedColormap.from_list('black_to_red', ['red', 'black'])
-    base_colors1 = base_cmap1(np.arange(base_cmap1.N))
-    alpha_channel1 = np.ones(base_colors1.shape[0])
-    alpha_channel1[0] = 0  # Set lowest value to transparent
-    base_colors1[:, -1] = alpha_channel1
-    cmap1 = ListedColormap(base_colors1)
+    # Process raster data for analysis result, reprojected to EPSG:4326
+    results, reprojected_result_raster, transform = reprojected_result(candidates, dwellings, frozenset(individual))
     
     # Plot reprojected result raster as a heatmap
     heatmap1 = ax.imshow(
-        reprojected_result_raster, cmap=cmap1,
+        reprojected_result_raster, cmap=_result_colormap(),
         norm=BoundaryNorm(boundaries=np.linspace(np.min(reprojected_result_raster), np.max(reprojected_result_raster), 256), ncolors=256),
-        extent=raster_extent, alpha=1)
+        extent=_plotting_extent(reprojected_result_raster, transform), alpha=1)
     
-    # Overlay TIF files for each location in the individual
+    # Mark every selected location in one call (geopandas redraws the
+    # figure on each plot call)
+    candidate_gdf.loc[list(individual)].plot(ax=ax, marker='x', color='black', markersize=20, alpha=0.5)
+
+    # Overlay the reduction raster of each location in the individual
     for location in individual:
-        location_tif = candidates.data_file / 'v_i'/ f'dry_walk_site_{location}.tif'
-        reprojected_tif_path = candidates.data_file / 'temp_data' / f'reprojected_{location}.tif'
-
-        hold_gdf= gpd.GeoDataFrame(geometry=candidate_gdf.loc[location], crs='EPSG:4326')
-        hold_gdf.plot(ax=ax, marker='x', color='black', markersize=20, alpha=0.5)
-        with rasterio.open(location_tif) as src:
-            transform, width, height = calculate_default_transform(
-                src.crs, 'EPSG:4326', src.width, src.height, *src.bounds)
-            kwargs = src.meta.copy()
-            kwargs.update({
-                'crs': 'EPSG:4326',
-                'transform': transform,
-                'width': width,
-                'height': height
-            })
-
-            with rasterio.open(reprojected_tif_path, 'w', **kwargs) as dst:
-                for i in range(1, src.count + 1):
-                    reproject(
-                        source=rasterio.band(src, i),
-                        destination=rasterio.band(dst, i),
-                        src_transform=src.transform,
-                        src_crs=src.crs,
-                        dst_transform=transform,
-                        dst_crs='EPSG:4326',
-                        resampling=Resampling.nearest)
-
-        # Display the reprojected TIF data on the map
-        with rasterio.open(reprojected_tif_path) as src:
-            show(src, ax=ax, alpha=0.4)
-
-    # Save the final map plot to PDF
-    output_path =  cwd+rf'\plots\{name}.pdf'
+        # Display the reprojected raster on the map
+        reprojected, location_transform = reprojected_candidate(candidates, location, 'reduction')
+        show(reprojected, transform=location_transform, ax=ax, alpha=0.4)
+
+    # Save the final map plot
+    output_dir = Path(output_dir) if output_dir is not None else Path.cwd() / 'plots'
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / f'{name}.{file_format}'
     plt.savefig(output_path, transparent=True, pad_inches=0.1, bbox_inches='tight')
+    return output_path
+
+def _init_render_worker(candidates, dwellings, candidate_gdf, candidate_layers, output_dir, file_format):
+    # Workers never show figures, so draw with the non-interactive backend
+    import matplotlib
+    matplotlib.use('Agg')
+    _load_plotting()
+
+    # Seed the caches with the layers the parent already projected
+    _candidate_frames[id(candidates.registry)] = (candidates.registry, candidate_gdf)
+    _candidate_layers.update(candidate_layers)
+    _render_state.update(candidates=candidates, dwellings=dwellings, output_dir=output_dir, file_format=file_format)
+
+def _render_build(task):
+    build, name = task
+    output_path = plot_result_with_map(build, _render_state['candidates'], _render_state['dwellings'], name,
+                                       output_dir=_render_state['output_dir'],
+                                       file_format=_render_state['file_format'])
+    plt.close('all')
+    return output_path
+
+def render_builds(builds, candidates, dwellings, names=None, output_dir=None, workers=None, file_format='pdf'):
+    """
+    Saves a plot_result_with_map figure for every build, e.g. a whole Pareto
+    front.
+
+    The candidate points and every site's reduction raster are projected
+    once in this process and handed to the workers, which draw with
+    matplotlib's non-interactive Agg backend.
+
+    Args:
+        builds (list): One list of candidate IDs per figure.
+        candidates (Candidates): Candidates with load_data() already run.
+        dwellings (Dwellings): Dwellings with load_data() already run.
+        names (list or None): File name of each figure, defaults to
+                              build_0, build_1, ...
+        output_dir (Path or None): Folder the figures are saved in, defaults
+                                   to ./plots.
+        workers (int or None): Number of processes; None or 1 renders
+                               in-process.
+        file_format (str): File extension, and so format, of the figures.
+
+    Returns:
+        list: Path of every saved figure, in the order of builds.
+    """
+    builds = [list(build) for build in builds]
+    names = [f'build_{k}' for k in range(len(builds))] if names is None else list(names)
+    if len(names) != len(builds):
+        raise ValueError('One name is needed per build')
+    output_dir = Path(output_dir) if output_dir is not None else Path.cwd() / 'plots'
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # --- STEP 1: Project the shared layers once ---
+    candidate_gdf = candidate_geodataframe(candidates)
+    for site in dict.fromkeys(site for build in builds for site in build):
+        reprojected_candidate(candidates, site, 'reduction')
+
+    # --- STEP 2: Render every build ---
+    if workers is None or workers <= 1 or len(builds) <= 1:
+        output_paths = []
+        for build, name in zip(builds, names):
+            output_paths.append(plot_result_with_map(build, candidates, dwellings, name, output_dir=output_dir,
+                                                     file_format=file_format))
+            plt.close('all')
+        return output_paths
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker,
+                             initargs=(candidates, dwellings, candidate_gdf, dict(_candidate_layers), output_dir,
+                                       file_format)) as pool:
+        return list(pool.map(_render_build, zip(builds, names)))
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Batched singleton and pairwise objective tables.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _decoded(candidates, candidate, layer):
+    patch = np.asarray(candidates.candidate_data[candidate][layer], dtype=np.float32)
+    return np.nan_to_num(patch * np.float32(candidates.layer_scale[layer]))
+
+
+def singleton_scores(candidates, dwellings, chunk=256):
+    """
+    Computes process_raster([id]) for every candidate in one batched pass.
+
+    Candidates are grouped by window shape; each group's patches are stacked
+    and weighted against a strided gather of the matching dwelling and
+    isolation windows, so no full-size raster is allocated.
+
+    Args:
+        candidates (Candidates): Candidates with load_data() already run.
+        dwellings (Dwellings): Dwellings with load_data() already run.
+        chunk (int): Number of candidates stacked at a time.
+
+    Returns:
+        tuple: (ids, scores) where scores[i] holds the reduction, coverage and
+               fairness totals of ids[i] built on its own.
+    """
+    ids = list(candidates.candidate_data.keys())
+    scores = np.zeros((len(ids), 3), dtype=np.float64)
+
+    # --- STEP 1: Group candidates with the same window shape ---
+    groups = {}
+    for row, candidate in enumerate(ids):
+        window = candidates.candidate_data[candidate]['window']
+        if window.height > 0 and window.width > 0:
+            groups.setdefault((window.height, window.width), []).append(row)
+
+    # --- STEP 2: Stack each group and weight it in one einsum ---
+    for (height, width), rows in groups.items():
+        dwelling_windows = sliding_window_view(dwellings.main_data, (height, width))
+        isolation_windows = sliding_window_view(dwellings.isolation_data, (height, width))
+        for start in range(0, len(rows), chunk):
+            part = rows[start:start + chunk]
+            windows = [candidates.candidate_data[ids[row]]['window'] for row in part]
+            row_off = np.array([window.row_off for window in windows])
+            col_off = np.array([window.col_off for window in windows])
+
+            reduction = np.stack([_decoded(candidates, ids[row], 'reduction') for row in part])
+            coverage = np.stack([_decoded(candidates, ids[row], 'coverage') for row in part])
+            main_data = dwelling_windows[row_off, col_off]
+            isolation_data = isolation_windows[row_off, col_off]
+
+            scores[part, 0] = np.einsum('nij,nij->n', reduction, main_data, dtype=np.float64)
+            scores[part, 1] = np.einsum('nij,nij->n', coverage, main_data, dtype=np.float64)
+            scores[part, 2] = np.einsum('nij,nij->n', coverage, isolation_data, dtype=np.float64)
+
+    return np.array(ids), scores
+
+
+def pairwise_scores(candidates, dwellings, singles=None, index=None):
+    """
+    Computes process_raster([a, b]) for every pair of overlapping candidates.
+
+    Since max(x, y) = x + y - min(x, y), a pair scores the sum of its two
+    singleton scores minus the weighted minimum over the overlap of the two
+    windows, so only the overlap is visited. Pairs that do not overlap
+    simply score the sum of their singletons and are not listed.
+
+    Args:
+        candidates (Candidates): Candidates with load_data() already run.
+        dwellings (Dwellings): Dwellings with load_data() already run.
+        singles (tuple or None): Output of singleton_scores(), computed if
+                                 not given.
+        index (InteractionIndex or None): If given, only its interacting
+                                          pairs are scored.
+
+    Returns:
+        dict: 'ids', 'pair_i' and 'pair_j' (rows into ids) and 'scores'
+              ((n_pairs, 3) totals of each pair).
+    """
+    ids, single = singles if singles is not None else singleton_scores(candidates, dwellings)
+    ids = ids.tolist()
+    windows = [candidates.candidate_data[candidate]['window'] for candidate in ids]
+    row_start = np.array([window.row_off for window in windows])
+    col_start = np.array([window.col_off for window in windows])
+    row_stop = row_start + np.array([window.height for window in windows])
+    col_stop = col_start + np.array([window.width for window in windows])
+
+    # --- STEP 1: Pairs whose windows overlap ---
+    if index is not None:
+        row_of = {candidate: row for row, candidate in enumerate(ids)}
+        pair_i = np.array([row_of[candidate] for candidate in index.ids[index.pair_i].tolist()], dtype=np.int64)
+        pair_j = np.array([row_of[candidate] for candidate in index.ids[index.pair_j].tolist()], dtype=np.int64)
+    else:
+        overlaps = ((row_start[:, None] < row_stop[None, :]) & (row_start[None, :] < row_stop[:, None])
+                    & (col_start[:, None] < col_stop[None, :]) & (col_start[None, :] < col_stop[:, None]))
+        pair_i, pair_j = np.nonzero(np.triu(overlaps, k=1))
+
+    # --- STEP 2: Correct the summed singletons over each overlap ---
+    scores = single[pair_i] + single[pair_j]
+    for k, (i, j) in enumerate(zip(pair_i.tolist(), pair_j.tolist())):
+        r0, r1 = max(row_start[i], row_start[j]), min(row_stop[i], row_stop[j])
+        c0, c1 = max(col_start[i], col_start[j]), min(col_stop[i], col_stop[j])
+        if r0 >= r1 or c0 >= c1:
+            continue
+        local_i = (slice(r0 - row_start[i], r1 - row_start[i]), slice(c0 - col_start[i], c1 - col_start[i]))
+        local_j = (slice(r0 - row_start[j], r1 - row_start[j]), slice(c0 - col_start[j], c1 - col_start[j]))
+        shared_reduction = np.minimum(_decoded(candidates, ids[i], 'reduction')[local_i],
+                                      _decoded(candidates, ids[j], 'reduction')[local_j])
+        shared_coverage = np.minimum(_decoded(candidates, ids[i], 'coverage')[local_i],
+                                     _decoded(candidates, ids[j], 'coverage')[local_j])
+        main_data = dwellings.main_data[r0:r1, c0:c1]
+        scores[k] -= (np.sum(shared_reduction * main_data, dtype=np.float64),
+                      np.sum(shared_coverage * main_data, dtype=np.float64),
+                      np.sum(shared_coverage * dwellings.isolation_data[r0:r1, c0:c1], dtype=np.float64))
+
+    return {'ids': np.array(ids), 'pair_i': np.asarray(pair_i), 'pair_j': np.asarray(pair_j), 'scores': scores}
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic data set with the same layout as the real data folder.
+"""
+
+import json
+from pathlib import Path
+from zipfile import ZipFile
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from class_candidates import LAYER_FOLDERS
+
+# CRS of the real rasters and candidate locations
+DATA_CRS = 'EPSG:32738'
+
+# Value written where a raster has no data, as in the real rasters
+NODATA = -9999.0
+
+
+def generate_dataset(data_folder, height=300, width=400, n_sites=60, window=40, resolution=100.0,
+                     n_settlements=12, zipped=False, seed=0):
+    """
+    Writes a synthetic data folder that Dwellings and Candidates can load.
+
+    The folder holds dwellings_count_utm_clipped.tif,
+    dwellings_isolation_norm_utm.tif, candidates.geojson and one
+    dry_walk_site_{id}.tif per site in v_i, v_b and v_t (or in v_i.zip,
+    v_b.zip and v_t.zip when zipped). Dwellings are Poisson counts around a
+    few settlements, isolation is the normalised distance to the nearest
+    settlement, and every site serves a disc of radius window / 2 with
+    reduction and walking time in thousandths. Sites near the bottom and
+    right edges have windows that run off the main raster, and IDs are
+    sparse, as in the real data.
+
+    Args:
+        data_folder (Path): Folder to write, created if needed.
+        height, width (int): Size of the main rasters in pixels.
+        n_sites (int): Number of candidate sites.
+        window (int): Side of each site's square raster in pixels.
+        resolution (float): Pixel size in metres.
+        n_settlements (int): Number of dwelling clusters.
+        zipped (bool): Write the candidate rasters into zip archives.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        list: The candidate IDs.
+    """
+    data_folder = Path(data_folder)
+    data_folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    x_origin, y_origin = 513000.0, 7225000.0
+    profile = dict(driver='GTiff', count=1, dtype='float32', crs=DATA_CRS, nodata=NODATA)
+
+    # --- STEP 1: Dwelling counts and isolation around settlements ---
+    rows, cols = np.mgrid[0:height, 0:width]
+    centres = rng.uniform((0, 0), (height, width), size=(n_settlements, 2))
+    spread = rng.uniform(0.02, 0.08, n_settlements) * min(height, width)
+    distance = np.full((height, width), np.inf)
+    intensity = np.zeros((height, width))
+    for (row, col), sigma in zip(centres, spread):
+        squared = (rows - row) ** 2 + (cols - col) ** 2
+        intensity += 5 * np.exp(-squared / (2 * sigma ** 2))
+        distance = np.minimum(distance, np.sqrt(squared))
+
+    dwellings = rng.poisson(intensity + 0.01).astype(np.float32)
+    isolation = np.where(dwellings > 0, distance / distance.max(), 0).astype(np.float32)
+    # Outside the study area the real rasters hold nodata
+    outside = (rows + cols) < min(height, width) // 10
+    dwellings[outside] = NODATA
+    isolation[outside] = np.nan
+
+    main_profile = dict(profile, height=height, width=width,
+                        transform=from_origin(x_origin, y_origin, resolution, resolution))
+    with rasterio.open(data_folder / 'dwellings_count_utm_clipped.tif', 'w', **main_profile) as dst:
+        dst.write(dwellings, 1)
+    with rasterio.open(data_folder / 'dwellings_isolation_norm_utm.tif', 'w', **main_profile) as dst:
+        dst.write(isolation, 1)
+
+    # --- STEP 2: Candidate locations ---
+    ids = np.sort(rng.choice(np.arange(1, 25 * n_sites), n_sites, replace=False)).tolist()
+    row_offs = rng.integers(0, max(1, height - window + window // 4), n_sites)
+    col_offs = rng.integers(0, max(1, width - window + window // 4), n_sites)
+    features = [{
+        'type': 'Feature',
+        'properties': {'new_id': candidate},
+        'geometry': {'type': 'Point', 'coordinates': [x_origin + (col_off + window / 2) * resolution,
+                                                      y_origin - (row_off + window / 2) * resolution]},
+    } for candidate, row_off, col_off in zip(ids, row_offs.tolist(), col_offs.tolist())]
+    with open(data_folder / 'candidates.geojson', 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'name': 'candidate_sites_synthetic',
+                   'crs': {'type': 'name', 'properties': {'name': 'urn:ogc:def:crs:EPSG::32738'}},
+                   'features': features}, f, indent=1)
+
+    # --- STEP 3: Reduction, coverage and time rasters of every site ---
+    site_rows, site_cols = np.mgrid[0:window, 0:window]
+    from_centre = np.hypot(site_rows + 0.5 - window / 2, site_cols + 0.5 - window / 2) / (window / 2)
+    served = from_centre < 1
+    folders = {folder: data_folder / folder for folder in LAYER_FOLDERS.values()}
+    for folder in folders.values():
+        folder.mkdir(exist_ok=True)
+
+    for candidate, row_off, col_off in zip(ids, row_offs.tolist(), col_offs.tolist()):
+        strength = rng.uniform(0.5, 1.0)
+        layers = {
+            'reduction': np.where(served, np.round(1000 * strength * (1 - from_centre)), NODATA),
+            'coverage': np.where(served, 1, NODATA),
+            'time': np.where(served, np.round(1000 * 45 * from_centre * rng.uniform(0.8, 1.2)), NODATA),
+        }
+        site_profile = dict(profile, height=window, width=window,
+                            transform=from_origin(x_origin + col_off * resolution, y_origin - row_off * resolution,
+                                                  resolution, resolution))
+        for layer, values in layers.items():
+            with rasterio.open(folders[LAYER_FOLDERS[layer]] / f'dry_walk_site_{candidate}.tif', 'w',
+                               **site_profile) as dst:
+                dst.write(values.astype(np.float32), 1)
+
+    if zipped:
+        for name, folder in folders.items():
+            with ZipFile(data_folder / f'{name}.zip', 'w') as z:
+                for path in sorted(folder.iterdir()):
+                    z.write(path, f'{name}/{path.name}')
+                    path.unlink()
+            folder.rmdir()
+
+    return ids